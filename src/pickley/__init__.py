@@ -1,13 +1,17 @@
+import hashlib
 import logging
 import os
 import re
+import socket
 import sys
+import time
 from datetime import datetime
 
 import runez
 
 from pickley.env import AvailablePythons, py_version_components, PythonFromPath
-from pickley.pypi import PypiInfo
+from pickley.metrics import METRICS
+from pickley.pypi import IndexStats, PypiInfo
 
 
 __version__ = runez.get_version(__name__)
@@ -16,9 +20,16 @@ DOT_META = ".%s" % PICKLEY
 K_CLI = {"delivery", "index", "python"}
 K_DIRECTIVES = {"include"}
 K_GROUPS = {"bundle", "pinned"}
-K_LEAVES = {"install_timeout", "pyenv", "version_check_delay"}
+K_LEAVES = {
+    "install_timeout", "max_concurrent_upgrades", "metrics_textfile", "offline", "pip_mode", "precompile", "pyenv",
+    "rollout_canary", "rollout_window", "venv_store", "version_check_delay", "wheelhouse",
+}
 
 DEFAULT_PYPI = "https://pypi.org/simple"
+FAILED_LOOKUP_TTL = 60  # Seconds during which a failed version lookup is not retried, doubled on each consecutive failure...
+FAILED_LOOKUP_MAX_TTL = 60 * 60  # ... up to this many seconds
+FETCH_LOCK_TTL = 30  # Seconds after which a version lookup lock is considered stale
+FETCH_LOCK_WAIT = 10  # Max seconds to wait for another process to finish looking up the same package
 RE_PYPI_CANONICAL = re.compile(r"^[a-z][a-z0-9-]*[a-z0-9]$")
 RE_PYPI_ACCEPTABLE = re.compile(r"^[a-z][a-z0-9._-]*[a-z0-9]$", re.IGNORECASE)
 
@@ -128,14 +139,11 @@ class PackageSpec(object):
         validate_pypi_name(self.original)
         self.dashed = canonical_pypi_name(self.original)
         self.wheelified = self.original.replace("-", "_").replace(".", "_")
-        self.pinned = cfg.pinned_version(self)
-        desired = cfg.get_value("python", pspec=self)
-        self.python = self.cfg.available_pythons.find_python(desired)
-        self.settings = TrackedSettings(
-            delivery=cfg.delivery_method(self),
-            index=cfg.index(self) or cfg.default_index,
-            python=self.python.executable,
-        )
+        self._pinned = runez.UNSET  # Resolved lazily (bulk commands such as 'list' only need 'dashed' and manifest)
+        self._python = None
+        self._settings = None
+        self.timings = {}  # Duration in seconds of notable installation phases, for reporting
+        self.prefetched = None  # Folder with already downloaded wheels for this package (and its dependencies), if any
 
     def __repr__(self):
         return self.specced or self.dashed
@@ -143,6 +151,35 @@ class PackageSpec(object):
     def __lt__(self, other):
         return str(self) < str(other)
 
+    @property
+    def pinned(self):
+        """str | None: Pinned version, if any"""
+        if self._pinned is runez.UNSET:
+            self._pinned = self.cfg.pinned_version(self)
+
+        return self._pinned
+
+    @property
+    def python(self):
+        """pickley.env.PythonInstallation: Python to use for this package (triggers interpreter discovery on first access)"""
+        if self._python is None:
+            desired = self.cfg.get_value("python", pspec=self)
+            self._python = self.cfg.available_pythons.find_python(desired)
+
+        return self._python
+
+    @property
+    def settings(self):
+        """TrackedSettings: Settings to install this package with"""
+        if self._settings is None:
+            self._settings = TrackedSettings(
+                delivery=self.cfg.delivery_method(self),
+                index=self.cfg.index(self) or self.cfg.default_index,
+                python=self.python.executable,
+            )
+
+        return self._settings
+
     @property
     def specced(self):
         if self.version:
@@ -220,27 +257,221 @@ class PackageSpec(object):
             return TrackedLatest(source="pinned", version=self.pinned)
 
         path = self.cfg.cache.full_path("%s.latest" % self.dashed)
-        age = self.cfg.version_check_delay(self)
-        if not force or runez.file.is_younger(path, age):
-            desired = TrackedLatest.from_file(path)
+        failed_path = self.cfg.cache.full_path("%s.failed" % self.dashed)
+        wheelhouse = self.cfg.wheelhouse(self)
+        failures = 0 if wheelhouse else runez.read_json(failed_path, default={}).get("failures") or 0
+        if not wheelhouse and not force:
+            if runez.file.is_younger(path, self.cfg.version_check_delay(self) * 60):
+                desired = TrackedLatest.from_file(path)
+                if desired:
+                    METRICS.cache_lookup("latest", hit=True)
+                    return desired
+
+            if failures and runez.file.is_younger(failed_path, failed_lookup_ttl(failures)):
+                desired = TrackedLatest.from_file(failed_path)
+                if desired:
+                    # Don't hammer an index that just failed us (or doesn't have this package), stick to last successful lookup if any
+                    METRICS.cache_lookup("latest", hit=True)
+                    return last_successful_lookup(path) or desired
+
+        if wheelhouse:
+            return self._desired_version_from(wheelhouse, PypiInfo(wheelhouse, self))  # Wheelhouse is local, lookups are not cached
+
+        if self.cfg.offline():
+            desired = last_successful_lookup(path)  # Regardless of age: index can't be queried
             if desired:
+                METRICS.cache_lookup("latest", hit=True)
                 return desired
 
-        index = self.index
-        info = PypiInfo(index, self)
+            METRICS.cache_lookup("latest", hit=False)
+            return TrackedLatest(problem="latest version is not cached, can't look it up in offline mode", source="latest")
+
+        fetch_lock = self.cfg.cache.full_path("%s.fetching" % self.dashed)
+        locked = acquire_fetch_lock(fetch_lock)
+        if not locked:
+            desired = awaited_lookup(fetch_lock, path, failed_path)
+            if desired:
+                METRICS.cache_lookup("latest", hit=True)
+                return desired  # Another process just looked up the same package, no need to query index again
+
+        METRICS.cache_lookup("latest", hit=False)
+        try:
+            for index in self.cfg.index_stats().ranked(self.cfg.indexes(self)):
+                info = PypiInfo(index, self)
+                if not info.unreachable:
+                    break  # Fail over to next mirror only if this one could not be reached
+
+            if info.problem and info.breaker and info.breaker.is_open:
+                previous = last_successful_lookup(path)
+                if previous:
+                    return previous  # Index is down, stick to last successful lookup during cool-down
+
+            desired = self._desired_version_from(index, info)
+            if desired.problem:
+                save_json_atomically(dict(desired.to_dict(), failures=failures + 1), failed_path)
+
+            else:
+                previous = TrackedLatest.from_file(path)
+                if previous and previous.version == desired.version and previous.first_seen:
+                    desired.first_seen = previous.first_seen  # Rollout delays are counted from when version was first seen
+
+                else:
+                    desired.first_seen = int(time.time())
+
+                save_json_atomically(desired.to_dict(), path)
+                runez.delete(failed_path, fatal=None, logger=None)
+
+            return desired
+
+        finally:
+            if locked:
+                runez.delete(fetch_lock, fatal=False, logger=None)
+
+    def _desired_version_from(self, index, info):
+        """
+        Args:
+            index (str): Index that was queried
+            info (PypiInfo): Lookup result
+
+        Returns:
+            (TrackedLatest): Desired version, never lower than currently installed one
+        """
         candidates = [("installed", self.get_current_version())]
         if self.dashed == PICKLEY:
             candidates.append(("current", __version__))
 
         candidates.append(("latest", info.latest))  # Latest is last to ensure its 'source' is picked if all candidates are None
         source, desired_version = max_version(candidates)
-        desired = TrackedLatest(index=index, problem=info.problem, source=source, version=desired_version)
-        if not desired.problem:
-            runez.save_json(desired.to_dict(), path, fatal=None)
+        return TrackedLatest(index=index, problem=info.problem, source=source, version=desired_version)
+
+    def rollout_eligible_at(self, desired):
+        """
+        Args:
+            desired (TrackedLatest): Desired version, as returned by get_desired_version_info()
+
+        Returns:
+            (int | None): Epoch at which this host starts auto-upgrading to 'desired' version (None if no rollout policy applies)
+        """
+        window = self.cfg.rollout_window(self)
+        if window and desired.source == "latest" and desired.first_seen:
+            delay = rollout_delay(socket.gethostname(), self.dashed, window * 60, self.cfg.rollout_canary(self))
+            return desired.first_seen + delay
+
+
+def acquire_fetch_lock(path):
+    """
+    Args:
+        path (str): Path to lock file guarding the version lookup of a package
+
+    Returns:
+        (bool): True if lock was acquired, False if another live process is currently looking up the same package
+    """
+    if runez.DRYRUN:
+        return True
+
+    for _ in range(2):
+        try:
+            fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.write(fd, ("%s\n" % os.getpid()).encode("utf-8"))
+            os.close(fd)
+            return True
+
+        except OSError:
+            folder = os.path.dirname(path)
+            if not os.path.isdir(folder):
+                runez.ensure_folder(folder, fatal=False, logger=None)
+                continue
+
+            lines = runez.readlines(path, default=None, first=1, errors="ignore")
+            pid = runez.to_int(lines[0]) if lines else None
+            if runez.file.is_younger(path, FETCH_LOCK_TTL) and (pid is None or runez.check_pid(pid)):
+                return False  # Held by a live process (pid is None while holder is still writing it)
+
+            runez.delete(path, fatal=False, logger=None)  # Stale lock, left behind by a dead process
 
+    return False
+
+
+def awaited_lookup(lock_path, *paths):
+    """
+    Args:
+        lock_path (str): Lock held by another process currently looking up a package
+        *paths (str): Cache files that the other process writes its lookup result to
+
+    Returns:
+        (TrackedLatest | None): Lookup result from other process, if it completed within FETCH_LOCK_WAIT seconds
+    """
+    started = file_mtime(lock_path)
+    cutoff = time.time() + FETCH_LOCK_WAIT
+    while os.path.exists(lock_path) and time.time() < cutoff:
+        time.sleep(0.1)
+
+    if started:
+        for path in paths:
+            mtime = file_mtime(path)
+            if mtime and mtime >= started:
+                desired = TrackedLatest.from_file(path)
+                if desired:
+                    return desired
+
+
+def last_successful_lookup(path):
+    """
+    Args:
+        path (str): Path to .latest cache file of a package
+
+    Returns:
+        (TrackedLatest | None): Last successfully looked up version (regardless of age), if any
+    """
+    desired = TrackedLatest.from_file(path)
+    if desired and desired.version and not desired.problem:
         return desired
 
 
+def save_json_atomically(data, path, keep_none=False):
+    """
+    Args:
+        data (dict): Data to save
+        path (str): Path to json file, written to a temp file first and then renamed (readers never see a partially written file)
+        keep_none (bool): If True, keep None values
+    """
+    tmp = "%s.%s.tmp" % (path, os.getpid())
+    runez.save_json(data, tmp, keep_none=keep_none, fatal=False, logger=None)
+    if os.path.exists(tmp):
+        os.rename(tmp, path)
+
+
+def failed_lookup_ttl(failures):
+    """
+    Args:
+        failures (int): Number of consecutive failed version lookups
+
+    Returns:
+        (int): Seconds during which to not retry a failed lookup
+    """
+    return min(FAILED_LOOKUP_TTL * 2 ** (failures - 1), FAILED_LOOKUP_MAX_TTL)
+
+
+def rollout_delay(hostname, package, window, canary=None):
+    """
+    Args:
+        hostname (str): Host doing the upgrade
+        package (str): Package being upgraded
+        window (int): Seconds over which adoption of new versions is spread out across hosts
+        canary (int | None): Percentage of hosts that adopt new versions right away
+
+    Returns:
+        (int): Seconds (deterministic per host and package) to wait after a new version is first seen, before adopting it
+    """
+    digest = hashlib.sha1(("%s:%s" % (hostname, package)).encode("utf-8")).hexdigest()  # nosec, not used for security
+    percentile = int(digest[:8], 16) * 100.0 / 0x100000000
+    canary = min(max(canary or 0, 0), 100)
+    if percentile < canary:
+        return 0
+
+    return int(window * (percentile - canary) / (100 - canary))
+
+
 def max_version(candidates):
     """Allows to ensure we don't downgrade"""
     highest_name = None
@@ -253,6 +484,35 @@ def max_version(candidates):
     return highest_name, highest
 
 
+def file_mtime(path):
+    """
+    Args:
+        path (str): Path to file
+
+    Returns:
+        (float | None): Modification time of 'path', None if it does not exist
+    """
+    try:
+        return os.path.getmtime(path)
+
+    except OSError:
+        return None
+
+
+def first_defined(values):
+    """First value from 'values' that is not None (falsy values such as 0 included), if any"""
+    for value in values:
+        if value is not None:
+            return value
+
+
+def first_value(values):
+    """First truthy value from 'values', if any"""
+    for value in values:
+        if value:
+            return value
+
+
 def get_default_index(*paths):
     """Configured pypi index from pip.conf"""
     for path in paths:
@@ -279,41 +539,86 @@ class PickleyConfig(object):
         self.pip_conf, self.pip_conf_index = get_default_index("~/.config/pip/pip.conf", "/etc/pip.conf")
         self.default_index = self.pip_conf_index or DEFAULT_PYPI
         self._explored = set()
+        self._index_stats = None
+        self._resolved = {}  # Memoized resolved values, per (key, package)
 
     def __repr__(self):
         return "<not-configured>" if self.base is None else runez.short(self.base)
 
-    def set_base(self, base_path, config_path=None, cli=None):
+    def set_base(self, base_path, config_path=None, cli=None, flags=None):
         """
         Args:
             base_path (str): Path to pickley base installation
             config_path (str | None): Optional configuration to use
             cli (TrackedSettings | None): Optional configuration settings passed via CLI flags
+            flags (dict | None): Optional other configuration values passed via CLI flags (not tracked in manifests)
         """
         self.base = FolderBase("base", base_path)
         self.meta = FolderBase("meta", os.path.join(self.base.path, DOT_META))
         self.cache = FolderBase("cache", os.path.join(self.meta.path, ".cache"))
         self.cli = cli
+        self._index_stats = None
+        self._resolved = {}
         self.configs = []
-        if cli:
-            cli = runez.serialize.json_sanitized(cli.to_dict(), keep_none=False)
-            self.configs.append(RawConfig(self, "cli", cli))
+        if cli or flags:
+            values = cli.to_dict() if cli else {}
+            if flags:
+                values.update(flags)
+
+            values = runez.serialize.json_sanitized(values, keep_none=False)
+            self.configs.append(RawConfig(self, "cli", values))
 
-        self._add_config_file(config_path)
-        self._add_config_file(self.meta.full_path("config.json"))
-        defaults = dict(delivery="wrap", install_timeout=30, version_check_delay=5)
+        self.configs.extend(self._file_configs(config_path, self.meta.full_path("config.json")))
+        defaults = dict(delivery="wrap", install_timeout=30, max_concurrent_upgrades=2, version_check_delay=5)
         self.configs.append(RawConfig(self, "defaults", defaults))
 
-    def _add_config_file(self, path, base=None):
+    def _file_configs(self, *paths):
+        """
+        Args:
+            *paths (str | None): Config files to load (with their includes), in order of precedence
+
+        Returns:
+            (list[RawConfig]): Loaded configs, from compiled snapshot in cache if none of the source files changed since
+        """
+        paths = [runez.resolved_path(p) for p in paths]
+        snapshot_path = self.cache.full_path("config.snapshot.json")
+        snapshot = runez.read_json(snapshot_path, default=None)
+        if snapshot and snapshot.get("version") == __version__ and snapshot.get("paths") == paths:
+            if all(file_mtime(path) == mtime for path, mtime in snapshot.get("sources", [])):
+                METRICS.cache_lookup("config", hit=True)
+                return [RawConfig(self, source, values) for source, values in snapshot.get("configs", [])]
+
+        METRICS.cache_lookup("config", hit=False)
+
+        configs = []
+        sources = []
+        for path in paths:
+            self._add_config_file(configs, sources, path)
+
+        if os.path.isdir(self.cache.path):  # Don't create cache folder just for this (config could be read-only)
+            snapshot = dict(version=__version__, paths=paths, sources=sources, configs=[[c.source, c.values] for c in configs])
+            save_json_atomically(snapshot, snapshot_path, keep_none=True)
+
+        return configs
+
+    def _add_config_file(self, configs, sources, path, base=None):
+        """
+        Args:
+            configs (list[RawConfig]): Where to add config loaded from 'path', and its includes
+            sources (list): Where to track [path, mtime] of all files examined (to know when a snapshot gets stale)
+            path (str | None): Path to config file
+            base (str | None): Base folder for relative 'path'
+        """
         path = runez.resolved_path(path, base=base)
-        if path and not any(c.source == path for c in self.configs):
+        if path and not any(c.source == path for c in self.configs + configs):
+            sources.append([path, file_mtime(path)])
             values = runez.read_json(path, default=None)
             if values:
-                self.configs.append(RawConfig(self, path, values))
+                configs.append(RawConfig(self, path, values))
                 included = values.get("include")
                 if included:
                     for additional in runez.flattened(included):
-                        self._add_config_file(additional, base=os.path.dirname(path))
+                        self._add_config_file(configs, sources, additional, base=os.path.dirname(path))
 
     def _pyenv_scanner(self):
         location = self.pyenv()
@@ -407,10 +712,11 @@ class PickleyConfig(object):
         Returns:
             Nested value from first RawConfig that defines it
         """
-        for c in self.configs:
-            value = c.get_nested(section, key)
-            if value:
-                return value
+        memo_key = (section, key)
+        if memo_key not in self._resolved:
+            self._resolved[memo_key] = first_value(c.get_nested(section, key) for c in self.configs)
+
+        return self._resolved[memo_key]
 
     def get_value(self, key, pspec=None, validator=None):
         """
@@ -422,10 +728,11 @@ class PickleyConfig(object):
         Returns:
             Value from first RawConfig that defines it
         """
-        for c in self.configs:
-            value = c.get_value(key, pspec, validator)
-            if value:
-                return value
+        memo_key = (key, pspec and pspec.dashed, validator)
+        if memo_key not in self._resolved:
+            self._resolved[memo_key] = first_value(c.get_value(key, pspec, validator) for c in self.configs)
+
+        return self._resolved[memo_key]
 
     def delivery_method(self, pspec=None):
         """
@@ -443,9 +750,31 @@ class PickleyConfig(object):
             pspec (PackageSpec | None): Package spec, when applicable
 
         Returns:
-            (str | None): Optional pypi index to use
+            (str | None): Optional pypi index to use (fastest healthy one, when several mirrors are configured)
         """
-        return self.get_value("index", pspec=pspec)
+        if self.get_value("index", pspec=pspec):
+            return self.index_stats().ranked(self.indexes(pspec))[0]
+
+    def indexes(self, pspec=None):
+        """
+        Args:
+            pspec (PackageSpec | None): Package spec, when applicable
+
+        Returns:
+            (list): Configured pypi index mirrors, in order of preference (default index if none configured)
+        """
+        value = self.get_value("index", pspec=pspec)
+        if not isinstance(value, list):
+            value = value and value.split(",")
+
+        return [i.strip() for i in value or [] if i and i.strip()] or [self.default_index]
+
+    def index_stats(self):
+        """pickley.pypi.IndexStats: Rolling latency and error rate of pypi index mirrors"""
+        if self._index_stats is None:
+            self._index_stats = IndexStats(self.cache and self.cache.path)
+
+        return self._index_stats
 
     def install_timeout(self, pspec=None):
         """
@@ -457,6 +786,50 @@ class PickleyConfig(object):
         """
         return self.get_value("install_timeout", pspec=pspec, validator=runez.to_int)
 
+    def max_concurrent_upgrades(self):
+        """
+        Returns:
+            (int): How many background auto-upgrades can run concurrently on this host (0: no cap)
+        """
+        # Not using get_value(), as it yields first truthy value, and 0 must be able to override the default here
+        return first_defined(c.get_value("max_concurrent_upgrades", None, runez.to_int) for c in self.configs)
+
+    def rollout_canary(self, pspec=None):
+        """
+        Args:
+            pspec (PackageSpec | None): Package spec, when applicable
+
+        Returns:
+            (int | None): Percentage of hosts that auto-upgrade to new versions right away, when a rollout window is configured
+        """
+        return self.get_value("rollout_canary", pspec=pspec, validator=runez.to_int)
+
+    def rollout_window(self, pspec=None):
+        """
+        Args:
+            pspec (PackageSpec | None): Package spec, when applicable
+
+        Returns:
+            (int | None): Minutes over which auto-upgrades to new versions are spread out across hosts
+        """
+        return self.get_value("rollout_window", pspec=pspec, validator=runez.to_int)
+
+    def metrics_textfile(self):
+        """
+        Returns:
+            (str | None): Path to .prom file where to export metrics (for node_exporter's textfile collector), if configured
+        """
+        path = self.get_value("metrics_textfile")
+        if path:
+            return runez.resolved_path(path)
+
+    def offline(self):
+        """
+        Returns:
+            (bool): If True, don't use network: versions come from cache (or pins) only, installs from local wheels only
+        """
+        return bool(self.get_value("offline", validator=runez.to_boolean))
+
     def pinned_version(self, pspec):
         """
         Args:
@@ -473,6 +846,31 @@ class PickleyConfig(object):
             if isinstance(pinned, runez.system.string_type):
                 return pinned
 
+    def pip_mode(self, pspec=None):
+        """
+        Args:
+            pspec (PackageSpec | None): Package spec, when applicable
+
+        Returns:
+            (str | None): How to provide pip to created venvs, see pickley.package.PIP_MODES
+        """
+        return self.get_value("pip_mode", pspec=pspec)
+
+    def precompile(self, pspec=None):
+        """
+        Args:
+            pspec (PackageSpec | None): Package spec, when applicable
+
+        Returns:
+            (int | None): Number of parallel workers to use to compile bytecode after install (0: one per CPU, None: let pip do it)
+        """
+        value = self.get_value("precompile", pspec=pspec)
+        if value is True:
+            return 0
+
+        if value:
+            return runez.to_int(value)
+
     def pyenv(self):
         """
         Returns:
@@ -492,6 +890,20 @@ class PickleyConfig(object):
         self._expand_bundle(result, set(), name)
         return result
 
+    def venv_store(self, pspec=None):
+        """
+        Args:
+            pspec (PackageSpec | None): Package spec, when applicable
+
+        Returns:
+            (pickley.package.VenvStore | None): Shared store of prebuilt venvs, if configured
+        """
+        path = self.get_value("venv_store", pspec=pspec)
+        if path:
+            from pickley.package import VenvStore
+
+            return VenvStore(runez.resolved_path(path))
+
     def version_check_delay(self, pspec=None):
         """
         Args:
@@ -502,6 +914,18 @@ class PickleyConfig(object):
         """
         return self.get_value("version_check_delay", pspec=pspec, validator=runez.to_int)
 
+    def wheelhouse(self, pspec=None):
+        """
+        Args:
+            pspec (PackageSpec | None): Package spec, when applicable
+
+        Returns:
+            (str | None): Local folder to install from (instead of pypi index), if configured
+        """
+        path = self.get_value("wheelhouse", pspec=pspec)
+        if path:
+            return runez.resolved_path(path)
+
     def colored_key(self, key, indent):
         if (key in K_CLI or key in K_LEAVES) and indent in (1, 3):
             return runez.teal(key)
@@ -529,16 +953,18 @@ class PickleyConfig(object):
 class TrackedLatest(object):
     """Tracked info in .pickley/.cache/<package>.latest"""
 
+    first_seen = None  # type: int # Epoch at which 'version' was first seen as latest on this host
     index = None  # type: str # Pypi url used
     pickley = None  # type: TrackedPickley
     problem = None  # type: str # Problem that occurred during pypi lookup, if any
     source = None  # type: str # How 'version' was determined
     version = None  # type: str
 
-    def __init__(self, index=None, pickley=None, problem=None, source=None, version=None):
+    def __init__(self, index=None, pickley=None, problem=None, source=None, version=None, first_seen=None):
         if pickley is None:
             pickley = TrackedPickley.current()
 
+        self.first_seen = first_seen
         self.index = index
         self.pickley = pickley
         self.problem = problem
@@ -555,10 +981,18 @@ class TrackedLatest(object):
                 problem=data.get("problem"),
                 source=data.get("source"),
                 version=data.get("version"),
+                first_seen=data.get("first_seen"),
             )
 
     def to_dict(self):
-        return dict(index=self.index, pickley=self.pickley.to_dict(), problem=self.problem, source=self.source, version=self.version)
+        return dict(
+            first_seen=self.first_seen,
+            index=self.index,
+            pickley=self.pickley.to_dict(),
+            problem=self.problem,
+            source=self.source,
+            version=self.version,
+        )
 
 
 class TrackedManifest(object):
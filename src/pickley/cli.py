@@ -3,22 +3,41 @@ See https://github.com/zsimic/pickley
 """
 
 import logging
+import math
 import os
+import subprocess  # nosec
 import sys
+import tempfile
+import threading
 import time
+from multiprocessing.pool import ThreadPool
 
 import click
 import runez
 from runez.render import PrettyTable
 
 from pickley import __version__, abort, CFG, DOT_META, inform, PackageSpec, specced, TrackedSettings, validate_pypi_name
-from pickley.delivery import DeliveryMethod, PICKLEY
-from pickley.package import PexPackager, PythonVenv, VenvPackager
+from pickley.delivery import delivered_source, DeliveryMethod, PICKLEY, wrapper_without_auto_upgrade
+from pickley.metrics import export_metrics, METRICS
+from pickley.package import build_wheels, PexPackager, PythonVenv, record_problems, run_with_timeout, STRIP_RULES, VenvPackager
+from pickley.pypi import PypiInfo
 from pickley.v1upgrade import V1Status
 
 
+try:
+    from queue import Queue
+
+except ImportError:  # pragma: no cover, python2
+    from Queue import Queue
+
+
 LOG = logging.getLogger(__name__)
 PACKAGER = VenvPackager  # Packager to use for this run
+SANITY_CHECK_WORKERS = 8  # Max number of sanity checks to run concurrently
+WHEELHOUSE_WORKERS = 4  # Max number of packages to build wheels for concurrently
+VERIFY_WORKERS = 8  # Max number of installations to verify concurrently
+BENCH_PERCENTILES = (50, 90, 99)  # Percentiles reported by 'bench' command
+PIPELINE_DEPTH = 2  # Max number of packages prefetched ahead of the one currently being installed, in pipelined upgrades
 
 
 def protected_main():
@@ -49,6 +68,28 @@ def setup_audit_log(cfg=CFG):
         )
 
 
+def lock_holder(path, invalid):
+    """
+    Args:
+        path (str): Path to lock file (first line: pid of process holding it, second line: CLI args it was invoked with)
+        invalid (int): Age in seconds after which to consider existing lock as invalid
+
+    Returns:
+        (str): CLI args of process holding the lock, if any
+    """
+    if not runez.file.is_younger(path, invalid):
+        return None  # Lock file does not exist or invalidation age reached
+
+    pid = None
+    for line in runez.readlines(path, default=[], errors="ignore"):
+        if pid is not None:
+            return line  # 2nd line hold CLI args process was invoked with
+
+        pid = runez.to_int(line)
+        if not runez.check_pid(pid):
+            return None  # PID is no longer active
+
+
 class SoftLockException(Exception):
     """Raised when soft lock can't be acquired"""
 
@@ -80,24 +121,15 @@ class SoftLock(object):
         Returns:
             (str): CLI args of process holding the lock, if any
         """
-        if not runez.file.is_younger(self.lock, self.invalid):
-            return None  # Lock file does not exist or invalidation age reached
-
-        pid = None
-        for line in runez.readlines(self.lock, default=[], errors="ignore"):
-            if pid is not None:
-                return line  # 2nd line hold CLI args process was invoked with
-
-            pid = runez.to_int(line)
-            if not runez.check_pid(pid):
-                return None  # PID is no longer active
+        return lock_holder(self.lock, self.invalid)
 
     def __enter__(self):
         """Acquire lock"""
         if CFG.base:
             runez.Anchored.add(CFG.base.path)
 
-        cutoff = time.time() + self.give_up
+        started = time.time()
+        cutoff = started + self.give_up
         holder_args = self._locked_by()
         while holder_args:
             if time.time() >= cutoff:
@@ -109,6 +141,7 @@ class SoftLock(object):
             holder_args = self._locked_by()
 
         # We got the soft lock
+        METRICS.lock_wait(time.time() - started)
         if not self.quiet:
             if runez.DRYRUN:
                 print("Would acquire %s" % runez.short(self.lock))
@@ -134,6 +167,114 @@ class SoftLock(object):
         runez.delete(self.lock, logger=None)
 
 
+class UpgradeSlots(object):
+    """
+    Counting lock capping how many background auto-upgrades run concurrently on this host (across all packages).
+    Each slot is a lock file in .pickley/.upgrade-slots/, with same contents as a SoftLock.
+    """
+
+    def __init__(self, folder, count, invalid):
+        """
+        Args:
+            folder (str): Folder holding slot lock files
+            count (int): Number of slots (0 or less: no cap)
+            invalid (int): Age in seconds after which to consider a slot held by a hung process as free
+        """
+        self.folder = folder
+        self.count = count
+        self.invalid = invalid
+        self.acquired = None  # Path to slot lock file we're holding, if any
+
+    def __repr__(self):
+        return "%s slots in %s" % (self.count, runez.short(self.folder))
+
+    def _grab(self, path):
+        tmp = "%s.%s.tmp" % (path, os.getpid())
+        runez.write(tmp, "%s\n%s\n" % (os.getpid(), runez.quoted(sys.argv[1:])), logger=None)
+        try:
+            # Atomic, and fails if slot is taken. Slot file appears with its contents already there,
+            # so that other processes never see it empty (which they would consider stale, and reclaim)
+            os.link(tmp, path)
+
+        except OSError:
+            return False  # Slot is taken
+
+        finally:
+            runez.delete(tmp, logger=None)
+
+        self.acquired = path
+        return True
+
+    def _reclaim(self, path):
+        """
+        Args:
+            path (str): Slot lock file to take over, if it is held by a dead or hung process
+
+        Returns:
+            (bool): True if slot was reclaimed (ie: it is now held by current process)
+        """
+        if lock_holder(path, self.invalid) is not None:
+            return False
+
+        stale = "%s.%s.stale" % (path, os.getpid())
+        try:
+            os.rename(path, stale)  # Atomic: only one process can move a given stale slot out of the way
+
+        except OSError:
+            return False  # Another process reclaimed this slot first
+
+        if lock_holder(stale, self.invalid) is not None:
+            # Slot was reclaimed (and re-grabbed) by another process right after our check above: give it back
+            try:
+                os.link(stale, path)
+
+            except OSError:  # pragma: no cover, slot was grabbed yet again in the meantime
+                pass
+
+            runez.delete(stale, logger=None)
+            return False
+
+        runez.delete(stale, logger=None)
+        return self._grab(path)
+
+    def acquire(self):
+        """
+        Returns:
+            (bool): True if a slot could be acquired (or there is no cap)
+        """
+        if not self.count or self.count <= 0 or runez.DRYRUN:
+            return True
+
+        runez.ensure_folder(self.folder, logger=None)
+        for i in range(self.count):
+            path = os.path.join(self.folder, "%s.lock" % i)
+            if self._grab(path) or self._reclaim(path):
+                return True
+
+        return False
+
+    def release(self):
+        if self.acquired:
+            runez.delete(self.acquired, logger=None)
+            self.acquired = None
+
+
+def rollout_wait(pspec, desired):
+    """
+    Args:
+        pspec (PackageSpec): Package spec
+        desired (pickley.TrackedLatest): Desired version
+
+    Returns:
+        (int): Seconds to wait before this host is eligible to auto-upgrade to 'desired' version (0 if eligible now)
+    """
+    eligible_at = pspec.rollout_eligible_at(desired)
+    if eligible_at:
+        return max(int(eligible_at - time.time()), 0)
+
+    return 0
+
+
 def perform_install(pspec, give_up=5, is_upgrade=False, force=False, quiet=False):
     """
     Args:
@@ -154,6 +295,7 @@ def perform_install(pspec, give_up=5, is_upgrade=False, force=False, quiet=False
 
         if not pspec.version:
             desired = pspec.get_desired_version_info(force=force)
+            pspec.timings["resolve"] = time.time() - started
             if desired.problem:
                 action = "upgrade" if is_upgrade else "install"
                 abort("Can't %s %s: %s" % (action, pspec, runez.red(desired.problem)))
@@ -168,13 +310,20 @@ def perform_install(pspec, give_up=5, is_upgrade=False, force=False, quiet=False
             return manifest
 
         manifest = PACKAGER.install(pspec)
+        if manifest and not runez.DRYRUN:
+            METRICS.installed(pspec.dashed, dict(pspec.timings, total=time.time() - started))
+
         if manifest and not quiet:
             note = ""
             if runez.DRYRUN:
                 action = "Would upgrade" if is_upgrade else "Would install"
 
             else:
-                note = runez.dim(" in %s" % runez.represented_duration(time.time() - started))
+                note = " in %s" % runez.represented_duration(time.time() - started)
+                if "precompile" in pspec.timings:
+                    note += " (precompiled in %s)" % runez.represented_duration(pspec.timings["precompile"])
+
+                note = runez.dim(note)
                 action = "Upgraded" if is_upgrade else "Installed"
 
             inform("%s %s v%s%s" % (action, pspec.dashed, runez.bold(pspec.version), note))
@@ -217,11 +366,13 @@ def find_base():
 @runez.click.dryrun("-n")
 @runez.click.color()
 @click.option("--config", "-c", default="~/.config/pickley.json", metavar="PATH", help="Configuration to use")
-@click.option("--index", "-i", metavar="PATH", help="Pypi index to use")
+@click.option("--index", "-i", metavar="PATH", help="Pypi index to use (comma separated mirrors allowed)")
 @click.option("--python", "-P", metavar="PATH", help="Python interpreter to use")
 @click.option("--delivery", "-d", help="Delivery method to use")
 @click.option("--packager", "-p", type=click.Choice(["pex", "venv"]), help="Packager to use")
-def main(ctx, debug, config, index, python, delivery, packager):
+@click.option("--wheelhouse", "-w", metavar="PATH", help="Install from wheels in this folder only (no pypi index)")
+@click.option("--offline", is_flag=True, help="Don't use network: cached versions and local wheels only")
+def main(ctx, debug, config, index, python, delivery, packager, wheelhouse, offline):
     """Package manager for python CLIs"""
     global PACKAGER
     PACKAGER = PexPackager if packager == "pex" else VenvPackager
@@ -230,7 +381,9 @@ def main(ctx, debug, config, index, python, delivery, packager):
     if ctx.invoked_subcommand != "package":
         cli = TrackedSettings(delivery, index, python)
         base = find_base()
-        CFG.set_base(base, config_path=config, cli=cli)
+        CFG.set_base(base, config_path=config, cli=cli, flags=dict(offline=offline or None, wheelhouse=wheelhouse))
+        if ctx.invoked_subcommand in ("check", "install", "upgrade"):
+            ctx.call_on_close(lambda: export_metrics(CFG))
 
     runez.log.setup(
         debug=debug,
@@ -240,10 +393,17 @@ def main(ctx, debug, config, index, python, delivery, packager):
         locations=None,
     )
 
+    if ctx.invoked_subcommand != "package":
+        # Done once command completes, to also pick up what it moved to trash (or a deletion left unfinished by a previous run)
+        ctx.call_on_close(lambda: reap_trash(CFG))
+
 
 def auto_upgrade_v1(cfg):
     """Look for v1 installations, and upgrade them to v2"""
     v1 = V1Status(cfg)
+    if v1.migrated:
+        return
+
     if v1.installed:
         # On first auto-upgrade pickley (ran in background by wrapper)
         setup_audit_log(cfg)
@@ -268,6 +428,11 @@ def auto_upgrade_v1(cfg):
         v1.clean_old_files()
         inform("Done")
 
+    elif v1.leftovers:
+        v1.clean_old_files()
+
+    v1.mark_migrated()
+
 
 def bootstrap():  # pragma: no cover, exercised via test_bootstrap() functional test
     """Bootstrap pickley (reinstall with venv instead of downloaded pex package)"""
@@ -325,11 +490,32 @@ def auto_upgrade(force, package):
         sys.exit(0)
 
     runez.touch(ping)
+    click.get_current_context().call_on_close(lambda: export_metrics(CFG))  # Only when a check is actually done
     if runez.file.is_younger(pspec.lock_path, CFG.install_timeout(pspec) * 60):
         LOG.debug("Lock file present, another installation is in progress")
         sys.exit(0)
 
-    perform_install(pspec, is_upgrade=True, force=False, quiet=True)
+    if CFG.rollout_window(pspec):
+        manifest = pspec.get_manifest()
+        desired = pspec.get_desired_version_info()
+        eligible_in = rollout_wait(pspec, desired)
+        if manifest and manifest.version != desired.version and eligible_in:
+            LOG.debug("Deferring auto-upgrade to v%s, host eligible in %s" % (desired.version, runez.represented_duration(eligible_in)))
+            sys.exit(0)
+
+    invalid = CFG.install_timeout(pspec) * 60
+    slots = UpgradeSlots(CFG.meta.full_path(".upgrade-slots"), CFG.max_concurrent_upgrades(), invalid)
+    if not slots.acquire():
+        # Don't stack up behind the cap: forget the ping, so that next invocation of the wrapper tries again
+        LOG.debug("Deferring auto-upgrade, %s already in progress" % runez.plural(slots.count, "other upgrade"))
+        runez.delete(ping, logger=None)
+        sys.exit(0)
+
+    try:
+        perform_install(pspec, is_upgrade=True, force=False, quiet=True)
+
+    finally:
+        slots.release()
 
 
 @main.command()
@@ -338,6 +524,104 @@ def base():
     print(CFG.base.path)
 
 
+def percentile(values, pct):
+    """
+    Args:
+        values (list): Measured values
+        pct (int): Percentile to compute (nearest-rank method)
+
+    Returns:
+        (float): Value at 'pct' percentile
+    """
+    values = sorted(values)
+    rank = max(int(math.ceil(pct / 100.0 * len(values))), 1)
+    return values[rank - 1]
+
+
+def represented_overhead(seconds):
+    """str: Overhead in milliseconds, with explicit sign"""
+    return "%+.1f ms" % (seconds * 1000)
+
+
+def timed_run(program, args):
+    """
+    Args:
+        program (str): Program to run
+        args (list): Arguments to pass to 'program'
+
+    Returns:
+        (float, int): Time in seconds 'program' took to exit, and its exit code
+    """
+    cmd = [program]
+    cmd.extend(args)
+    with open(os.devnull, "w") as devnull:
+        started = time.time()
+        exit_code = subprocess.call(cmd, stdout=devnull, stderr=devnull)  # nosec
+        return time.time() - started, exit_code
+
+
+@main.command(context_settings=dict(ignore_unknown_options=True))
+@click.option("--runs", "-r", default=20, type=click.IntRange(1, None), help="How many times to run each variant")
+@click.argument("entry_point", required=True)
+@click.argument("args", nargs=-1, required=False, type=click.UNPROCESSED)
+def bench(runs, entry_point, args):
+    """Measure overhead of delivered entry point (wrapper, symlink) compared to running venv executable directly"""
+    target = CFG.base.full_path(entry_point)
+    source = (os.path.exists(target) or os.path.islink(target)) and delivered_source(target)
+    if not source:
+        abort("%s was not delivered by pickley" % runez.red(runez.short(target)))
+
+    args = args or ["--help"]
+    variants = [("direct", source)]
+    folder = tempfile.mkdtemp(prefix="pickley-bench-")
+    try:
+        symlink = os.path.join(folder, entry_point)
+        os.symlink(source, symlink)
+        variants.append(("symlink", symlink))
+        contents = wrapper_without_auto_upgrade(target)
+        if contents:
+            bare = os.path.join(folder, "%s-no-auto-upgrade" % entry_point)
+            runez.write(bare, contents, logger=None)
+            runez.make_executable(bare, logger=None)
+            variants.append(("wrapper without auto-upgrade", bare))
+            variants.append(("wrapper", target))
+
+        timings = dict((name, []) for name, _ in variants)
+        failed = set()
+        for i in range(runs + 1):  # First round is a warm-up, not measured
+            for name, program in variants:  # Interleaved, so that system noise affects all variants alike
+                elapsed, exit_code = timed_run(program, args)
+                if exit_code:
+                    failed.add(name)
+
+                if i:
+                    timings[name].append(elapsed)
+
+    finally:
+        runez.delete(folder, logger=None)
+
+    table = PrettyTable(["Variant"] + ["p%s" % p for p in BENCH_PERCENTILES] + ["min", "max"], border="github")
+    table.header.style = runez.bold
+    median = {}
+    for name, _ in variants:
+        values = timings[name]
+        median[name] = percentile(values, 50)
+        row = [percentile(values, p) for p in BENCH_PERCENTILES] + [min(values), max(values)]
+        table.add_row(runez.red(name) if name in failed else name, *["%.1f ms" % (v * 1000) for v in row])
+
+    print("%s %s, %s each:\n" % (runez.bold(entry_point), runez.quoted(args), runez.plural(runs, "run")))
+    print(table)
+    overhead = ["symlink %s" % represented_overhead(median["symlink"] - median["direct"])]
+    if "wrapper" in median:
+        overhead.append("wrapper bash hop %s" % represented_overhead(median["wrapper without auto-upgrade"] - median["symlink"]))
+        overhead.append("auto-upgrade spawn %s" % represented_overhead(median["wrapper"] - median["wrapper without auto-upgrade"]))
+        overhead.append("total %s" % represented_overhead(median["wrapper"] - median["direct"]))
+
+    print("\nOverhead (p50, compared to running venv executable directly): %s" % ", ".join(overhead))
+    if failed:
+        print(runez.red("\nNon-zero exit code from: %s" % ", ".join(sorted(failed))))
+
+
 @main.command()
 @click.option("--force", "-f", is_flag=True, help="Force check, even if checked recently")
 @click.option("--verbose", "-v", is_flag=True, help="Show more information")
@@ -368,6 +652,9 @@ def check(force, verbose, packages):
         else:
             action = "upgraded to" if desired.source == "latest" else "caught up to %s" % desired.source
             msg = "v%s installed, can be %s v%s" % (runez.dim(manifest.version), action, dv)
+            eligible_in = rollout_wait(pspec, desired)
+            if eligible_in:
+                msg += runez.dim(" (auto-upgrade on this host in %s)" % runez.represented_duration(eligible_in))
 
         print("%s: %s" % (pspec.dashed, msg))
 
@@ -434,9 +721,85 @@ def list(verbose):
     print(table)
 
 
+class PipelinedUpgrade(object):
+    """
+    Upgrade packages in 2 overlapping stages:
+    - producer: resolve desired version, and download/build wheels of upcoming packages (network bound)
+    - consumer: install packages from already downloaded wheels (CPU/disk bound)
+    """
+
+    def __init__(self, packages, depth=PIPELINE_DEPTH):
+        """
+        Args:
+            packages (list[PackageSpec]): Packages to upgrade
+            depth (int): Max number of packages prefetched ahead of the one currently being installed
+        """
+        self.packages = packages
+        self.queue = Queue(maxsize=depth)
+        self.folder = CFG.cache.full_path("wheels-%s" % os.getpid())  # Staging folder for downloaded wheels, specific to this run
+        self.timings = dict(resolve=0, download=0, install=0, wait=0)
+
+    def _produce(self):
+        try:
+            for pspec in self.packages:
+                started = time.time()
+                manifest = pspec.get_manifest()
+                desired = pspec.get_desired_version_info()
+                self.timings["resolve"] += time.time() - started
+                local_only = CFG.offline() or CFG.wheelhouse(pspec)  # Installs come from local disk only, nothing to prefetch
+                if not desired.problem and manifest and desired.version != manifest.version and not local_only:
+                    started = time.time()
+                    pspec.version = desired.version
+                    r = build_wheels(pspec, self.folder)
+                    if r.succeeded:
+                        pspec.prefetched = self.folder
+
+                    else:
+                        LOG.debug("Could not prefetch wheels for %s, will install from index:\n%s", pspec, r.full_output)
+
+                    self.timings["download"] += time.time() - started
+
+                self.queue.put(pspec)
+
+        except BaseException as e:  # SystemExit included, abort() may be called while resolving versions
+            self.queue.put(e)
+
+        finally:
+            self.queue.put(None)  # Consumer must always be released
+
+    def run(self):
+        started = time.time()
+        producer = threading.Thread(target=self._produce)
+        producer.daemon = True  # Don't hold process if consumer aborts
+        producer.start()
+        try:
+            while True:
+                waited = time.time()
+                pspec = self.queue.get()
+                self.timings["wait"] += time.time() - waited
+                if pspec is None:
+                    break
+
+                if isinstance(pspec, BaseException):
+                    raise pspec
+
+                installed = time.time()
+                perform_install(pspec, is_upgrade=True, force=False, quiet=False)
+                self.timings["install"] += time.time() - installed
+
+        finally:
+            runez.delete(self.folder, logger=None)
+
+        summary = ", ".join("%s %s" % (k, runez.represented_duration(v)) for k, v in sorted(self.timings.items()))
+        inform("Pipelined upgrade of %s packages done in %s (%s)" % (
+            len(self.packages), runez.represented_duration(time.time() - started), summary
+        ))
+
+
 @main.command()
+@click.option("--pipeline", is_flag=True, help="Download upcoming packages while installing current one")
 @click.argument("packages", nargs=-1, required=False)
-def upgrade(packages):
+def upgrade(pipeline, packages):
     """Upgrade an installed package"""
     setup_audit_log()
     packages = CFG.package_specs(packages)
@@ -444,6 +807,10 @@ def upgrade(packages):
         inform("No packages installed, nothing to upgrade")
         sys.exit(0)
 
+    if pipeline:
+        PipelinedUpgrade(packages).run()
+        return
+
     for pspec in packages:
         perform_install(pspec, is_upgrade=True, force=False, quiet=False)
 
@@ -472,25 +839,248 @@ def uninstall(all, packages):
             for ep in manifest.entrypoints:
                 runez.delete(pspec.exe_path(ep))
 
-        runez.delete(pspec.meta_path)
+        move_to_trash(CFG, pspec.meta_path)
         action = "Would uninstall" if runez.DRYRUN else "Uninstalled"
         inform("%s %s" % (action, pspec.dashed))
 
     if all:
         runez.delete(CFG.base.full_path(PICKLEY))
-        runez.delete(CFG.meta.path)
+        trash = move_to_trash(CFG, CFG.meta.path)  # Goes to a sibling trash folder, since .pickley itself is going away
+        if trash:
+            delete_in_background([trash])
         inform("pickley is now %s" % runez.red("uninstalled"))
 
 
+def move_to_trash(cfg, path):
+    """Move 'path' to trash (instant rename), actual deletion is done in the background by reap_trash()
+
+    Args:
+        cfg (pickley.PickleyConfig): Configuration
+        path (str): Folder to delete
+
+    Returns:
+        (str | None): Trash folder 'path' was moved into, if it could be moved
+    """
+    if runez.DRYRUN or not os.path.isdir(path):
+        runez.delete(path)
+        return None
+
+    if path == cfg.meta.path:
+        trash = cfg.base.full_path("%s.trash" % DOT_META)
+
+    else:
+        trash = cfg.meta.full_path(".trash")
+
+    target = os.path.join(trash, "%s-%s-%s" % (os.path.basename(path), int(time.time()), os.getpid()))
+    try:
+        runez.ensure_folder(trash, logger=None)
+        os.rename(path, target)
+        LOG.debug("Moved %s to %s", runez.short(path), runez.short(target))
+        return trash
+
+    except OSError as e:  # pragma: no cover, for example: trash is on another device
+        LOG.debug("Can't move %s to trash: %s", runez.short(path), e)
+        runez.delete(path)
+        return None
+
+
+def reap_trash(cfg):
+    """Delete contents of .pickley/.trash in a detached background process (unless one is already at it)
+
+    Args:
+        cfg (pickley.PickleyConfig): Configuration
+    """
+    trash = cfg.meta and cfg.meta.full_path(".trash")
+    if runez.DRYRUN or not trash or not os.path.isdir(trash):
+        return
+
+    marker = os.path.join(trash, ".reaper")  # Holds pid of background process emptying the trash
+    paths = [os.path.join(trash, fname) for fname in os.listdir(trash) if fname != ".reaper"]
+    if not paths:
+        return
+
+    pid = runez.to_int(runez.readlines(marker, default=[""], first=1)[0])
+    if pid and runez.check_pid(pid):
+        return  # Previous run is still at it
+
+    pid = delete_in_background(paths)
+    runez.write(marker, "%s\n" % pid, logger=None)
+
+
+def delete_in_background(paths):
+    """
+    Args:
+        paths (list): Paths to delete, via a detached process (that keeps going after pickley exits)
+
+    Returns:
+        (int): Pid of spawned process
+    """
+    with open(os.devnull, "w") as devnull:
+        kwargs = dict(stdin=devnull, stdout=devnull, stderr=devnull)
+        if sys.version_info[0] >= 3:
+            kwargs["start_new_session"] = True
+
+        else:  # pragma: no cover
+            kwargs["preexec_fn"] = os.setsid
+
+        p = subprocess.Popen(["rm", "-rf"] + paths, **kwargs)  # nosec
+
+    LOG.debug("Deleting %s in background (pid %s)", runez.plural(paths, "folder"), p.pid)
+    return p.pid
+
+
+def verify_installation(pspec, sample=None):
+    """
+    Args:
+        pspec (PackageSpec): Package spec to verify
+        sample (int | None): If specified, verify hashes of only that percentage of installed files
+
+    Returns:
+        (PackageSpec, pickley.TrackedManifest | None, list, float): Outcome, with list of problems found
+    """
+    started = time.time()
+    problems = []
+    manifest = pspec.get_manifest()
+    if not manifest or not manifest.version:
+        problems.append("no manifest")
+
+    else:
+        pspec.version = manifest.version
+        venv = PythonVenv(pspec.install_path, None, None, create=False)
+        if not os.path.isdir(venv.folder):
+            problems.append("venv %s does not exist" % runez.short(venv.folder))
+
+        else:
+            if not os.path.exists(venv.py_path):
+                target = os.path.realpath(venv.py_path)
+                problems.append("python %s does not exist" % runez.short(target))
+
+            for name in manifest.entrypoints or []:
+                exe = pspec.exe_path(name)
+                source = delivered_source(exe) if os.path.exists(exe) or os.path.islink(exe) else None
+                if not source:
+                    problems.append("entry point %s is not delivered" % runez.short(exe))
+
+                elif not runez.is_executable(source):
+                    problems.append("entry point %s points to missing %s" % (runez.short(exe), runez.short(source)))
+
+            problems.extend(record_problems(venv.folder, sample=sample))
+
+    return pspec, manifest, problems, time.time() - started
+
+
+@main.command()
+@click.option("--json", "as_json", is_flag=True, help="Show report in json format")
+@click.option("--sample", type=click.IntRange(1, 100), help="Check hashes of only this percentage of installed files")
+@click.argument("packages", nargs=-1, required=False)
+def verify(as_json, sample, packages):
+    """Verify integrity of installed packages"""
+    specs = CFG.package_specs(packages)
+    if not specs:
+        print("No packages to verify (empty bundle?)" if packages else "No packages installed")
+        sys.exit(0)
+
+    packages = specs
+
+    pool = ThreadPool(min(len(packages), VERIFY_WORKERS))
+    try:
+        results = sorted(pool.imap_unordered(lambda p: verify_installation(p, sample=sample), packages), key=lambda x: x[0])
+
+    finally:
+        pool.close()
+        pool.join()
+
+    report = {}
+    table = PrettyTable("Package,Version,Problems,Took", border="github")
+    table.header.style = runez.bold
+    for pspec, manifest, problems, elapsed in results:
+        version = manifest and manifest.version
+        report[pspec.dashed] = dict(version=version, problems=problems)
+        table.add_row(
+            pspec.dashed,
+            version,
+            runez.red(", ".join(problems)) if problems else runez.green("OK"),
+            runez.represented_duration(elapsed),
+        )
+
+    failed = sum(1 for r in results if r[2])
+    if as_json:
+        print(runez.represented_json(report))
+
+    else:
+        print(table)
+        if failed:
+            print("\n%s with problems, reinstall with: %s" % (runez.plural(failed, "package"), runez.bold("pickley install -f <package>")))
+
+    sys.exit(1 if failed else 0)
+
+
+@main.command()
+@click.argument("folder", required=True)
+@click.argument("packages", nargs=-1, required=True)
+def wheelhouse(folder, packages):
+    """Download (or build) all wheels needed to install packages, for use via --wheelhouse"""
+    if CFG.offline():
+        abort("Can't fill wheelhouse %s in offline mode" % runez.red(runez.short(folder)))
+
+    specs = CFG.package_specs(packages)
+    if not specs:
+        abort("No packages to fill wheelhouse with: %s expands to nothing (empty bundle?)" % runez.red(" ".join(packages)))
+
+    packages = specs
+    folder = runez.resolved_path(folder)
+    runez.ensure_folder(folder)
+    for pspec in packages:
+        if not pspec.version:
+            pspec.version = pspec.pinned
+            if not pspec.version:
+                info = PypiInfo(pspec.index, pspec)  # Always from index: wheelhouse is what we're filling here
+                if info.problem:
+                    abort("Can't determine version of %s: %s" % (pspec, runez.red(info.problem)))
+
+                pspec.version = info.latest
+
+    def timed_build(pspec):
+        started = time.time()
+        r = build_wheels(pspec, folder)
+        return pspec, r, time.time() - started
+
+    table = PrettyTable("Package,Version,Took", border="github")
+    table.header.style = runez.bold
+    failed = []
+    pool = ThreadPool(min(len(packages), WHEELHOUSE_WORKERS))
+    try:
+        for pspec, r, duration in pool.imap_unordered(timed_build, packages):
+            version = pspec.version
+            if r.failed:
+                failed.append(pspec.dashed)
+                version = runez.red(version)
+                LOG.error("Building wheels for %s failed:\n%s", pspec, r.full_output)
+
+            table.add_row(pspec.dashed, version, runez.represented_duration(duration))
+
+    finally:
+        pool.close()
+        pool.join()
+
+    print(table)
+    if failed:
+        abort("Could not build wheels for: %s" % runez.red(", ".join(failed)))
+
+    inform("%s wheels available in %s" % (len([f for f in os.listdir(folder) if f.endswith(".whl")]), runez.short(folder)))
+
+
 @main.command()
 @click.option("--build", "-b", default="./build", show_default=True, help="Folder to use as build cache")
 @click.option("--dist", "-d", default="./dist", show_default=True, help="Folder where to produce package")
 @click.option("--symlink", "-s", help="Create symlinks for debian-style packaging, example: root:root/usr/local/bin")
 @click.option("--no-sanity-check", is_flag=True, help="Disable sanity check")
 @click.option("--sanity-check", default="--version", show_default=True, help="Args to invoke produced package for sanity check")
+@click.option("--sanity-check-timeout", default=60, show_default=True, help="Timeout in seconds for each sanity check")
 @click.option("--requirement", "-r", multiple=True, help="Install from the given requirements file (can be used multiple times)")
+@click.option("--strip", multiple=True, type=click.Choice(STRIP_RULES), help="Remove files not needed at runtime from produced package")
 @click.argument("folder", required=True)
-def package(build, dist, symlink, no_sanity_check, sanity_check, folder, requirement):
+def package(build, dist, symlink, no_sanity_check, sanity_check, sanity_check_timeout, requirement, strip, folder):
     """Package a project from source checkout"""
     folder = runez.resolved_path(folder)
     if not os.path.isdir(folder):
@@ -499,7 +1089,9 @@ def package(build, dist, symlink, no_sanity_check, sanity_check, folder, require
     if no_sanity_check:
         sanity_check = None
 
-    finalizer = PackageFinalizer(folder, build, dist, symlink, sanity_check, requirement)
+    finalizer = PackageFinalizer(
+        folder, build, dist, symlink, sanity_check, requirement, sanity_check_timeout=sanity_check_timeout, strip=strip
+    )
     problem = finalizer.resolve()
     if problem:
         sys.exit(problem)
@@ -521,7 +1113,7 @@ class PackageFinalizer(object):
     package_name = None  # type: str # Name from associated setup.py (after call to resolve())
     package_version = None  # type: str # Version from associated setup.py (after call to resolve())
 
-    def __init__(self, folder, build, dist, symlink, sanity_check, requirement, border="reddit"):
+    def __init__(self, folder, build, dist, symlink, sanity_check, requirement, sanity_check_timeout=60, strip=None, border="reddit"):
         """
         Args:
             folder (str): Folder where project to be packaged resides (must have a setup.py)
@@ -530,6 +1122,8 @@ class PackageFinalizer(object):
             symlink (str | None): Synlink specification, of the form 'root:root/...'
             sanity_check (str | None): CLI to use as sanity check for packaged exes (default: --version)
             requirement (list | None): Optional list of requirements files
+            sanity_check_timeout (int | None): Timeout in seconds after which a sanity check is considered as failed
+            strip (list | None): Optional strip rules to apply to produced package (see STRIP_RULES)
             border (str): Border to use for PrettyTable overview
         """
         self.folder = folder
@@ -538,6 +1132,8 @@ class PackageFinalizer(object):
         self.root = None
         self.symlink = Symlinker(symlink) if symlink else None
         self.sanity_check = sanity_check
+        self.sanity_check_timeout = sanity_check_timeout
+        self.strip = strip
         self.border = border
         default_req = runez.resolved_path("requirements.txt", base=folder)
         if not requirement and os.path.exists(default_req):
@@ -584,29 +1180,100 @@ class PackageFinalizer(object):
             if r.failed or not self.package_version:
                 return "Could not determine package version from setup.py"
 
+    def _run_sanity_check(self, exe):
+        """
+        Args:
+            exe (str): Path to executable to sanity check
+
+        Returns:
+            (str, runez.program.RunResult, float): Executable, outcome of its sanity check, and how long the check took
+        """
+        started = time.time()
+        r = run_with_timeout(self.sanity_check_timeout, exe, self.sanity_check, fatal=False)
+        return exe, r, time.time() - started
+
+    def sanity_checked(self, exes):
+        """
+        Args:
+            exes (list): Executables to sanity check
+
+        Yields:
+            (str, runez.program.RunResult | None, float | None): Sanity check outcome for each exe, in order of completion
+        """
+        if not self.sanity_check:
+            for exe in exes:
+                yield exe, None, None
+
+            return
+
+        pool = ThreadPool(min(len(exes), SANITY_CHECK_WORKERS))
+        try:
+            for result in pool.imap_unordered(self._run_sanity_check, exes):
+                yield result
+
+        finally:
+            pool.close()
+            pool.join()
+
     def finalize(self):
         """Run sanity check and/or symlinks, and return a report"""
         with runez.Anchored(self.folder):
             runez.ensure_folder(self.build)
             CFG.set_base(self.build)
             pspec = PackageSpec(CFG, specced(self.package_name, self.package_version))
-            exes = PACKAGER.package(pspec, self.build, runez.resolved_path(self.dist), self.requirements)
+            dist = runez.resolved_path(self.dist)
+            exes = PACKAGER.package(pspec, self.build, dist, self.requirements)
+            stripped = None
+            if exes and self.strip:
+                stripped = PrettyTable(["Strip rule", "Files", "Saved"], border=self.border)
+                stripped.header.style = "bold"
+                total = 0
+                for rule, files, size in PACKAGER.strip(dist, self.strip):
+                    total += size
+                    stripped.add_row(rule, files, runez.represented_bytesize(size))
+
+                stripped.add_row(runez.bold("total"), "", runez.bold(runez.represented_bytesize(total)))
+
             if exes:
-                report = PrettyTable(["Executable", self.sanity_check], border=self.border)
+                report = PrettyTable(["Executable", self.sanity_check, "Took"], border=self.border)
                 report.header.style = "bold"
                 if not self.sanity_check:
-                    report.header[1].shown = False
+                    report.header.hide(1, 2)
 
-                for exe in exes:
+                started = time.time()
+                failed = []
+                slowest = None
+                for exe, r, duration in self.sanity_checked(exes):
                     exe_info = None
-                    if self.sanity_check:
-                        r = runez.run(exe, self.sanity_check)
+                    if r is not None:
                         exe_info = r.output or r.error
+                        if r.failed:
+                            failed.append(exe)
+                            exe_info = runez.red(exe_info)
+
+                        if slowest is None or duration > slowest[1]:
+                            slowest = (exe, duration)
+
+                        duration = runez.represented_duration(duration)
 
-                    report.add_row(runez.quoted(exe), exe_info)
+                    report.add_row(runez.quoted(exe), exe_info, duration)
                     if self.symlink and exe and self.root:
                         self.symlink.apply(exe, self.root)
 
+                if slowest:
+                    duration = runez.represented_duration(time.time() - started)
+                    exe, slowest_duration = slowest
+                    summary = "Sanity checked %s executables in %s, slowest: %s (%s)" % (
+                        len(exes), duration, runez.short(exe), runez.represented_duration(slowest_duration)
+                    )
+                    report = "%s\n%s" % (report, summary)
+
+                if stripped:
+                    report = "%s\n\n%s" % (stripped, report)
+
+                if failed:
+                    abort("%s\n\nSanity check failed for: %s" % (report, runez.red(runez.quoted([runez.short(x) for x in failed]))))
+
                 return report
 
 
@@ -1,5 +1,6 @@
 import logging
 import os
+import re
 
 import runez
 from runez import short
@@ -9,6 +10,8 @@ from pickley import abort, PICKLEY
 LOG = logging.getLogger(__name__)
 
 WRAPPER_MARK = "# Wrapper generated by https://pypi.org/project/pickley/"
+RE_WRAPPER_SOURCE = re.compile(r'^\s*(?:\S+ )?exec (\S+|"[^"]+") "\$@"$')
+RE_WRAPPER_AUTO_UPGRADE = re.compile(r"^(\s*)\S*nohup .* auto-upgrade .*$")
 
 GENERIC_WRAPPER = """
 #!/bin/bash
@@ -164,6 +167,39 @@ class DeliveryMethodWrap(DeliveryMethod):
         runez.make_executable(target)
 
 
+def delivered_source(target):
+    """
+    Args:
+        target (str): Path to delivered executable (symlink or pickley wrapper)
+
+    Returns:
+        (str | None): Path to executable 'target' delegates to, if it was delivered by pickley
+    """
+    if os.path.islink(target):
+        path = os.readlink(target)
+        return os.path.join(os.path.dirname(target), path)
+
+    lines = runez.readlines(target, default=[], errors="ignore")
+    if any(WRAPPER_MARK in line for line in lines[:5]):
+        for line in lines:
+            m = RE_WRAPPER_SOURCE.match(line)
+            if m:
+                return m.group(1).strip('"')
+
+
+def wrapper_without_auto_upgrade(target):
+    """
+    Args:
+        target (str): Path to pickley wrapper
+
+    Returns:
+        (str | None): Contents of same wrapper, with its background auto-upgrade spawn replaced by a no-op
+    """
+    lines = runez.readlines(target, default=[], errors="ignore")
+    if any(WRAPPER_MARK in line for line in lines[:5]):
+        return "\n".join(RE_WRAPPER_AUTO_UPGRADE.sub(r"\1:", line) for line in lines) + "\n"
+
+
 def ensure_safe_to_replace(cfg, target):
     """
     Args:
@@ -0,0 +1,267 @@
+import logging
+import os
+import time
+
+import runez
+
+
+LOG = logging.getLogger(__name__)
+METRICS_LOCK_WAIT = 5  # Max seconds to wait for another process to finish exporting metrics
+
+
+class MetricsCollector(object):
+    """Metrics recorded by current pickley run, merged into persisted state on export"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget recorded metrics (done once they're merged into persisted state)"""
+        self.cache = {}  # type: dict # Cache name -> [hits, misses]
+        self.indexes = {}  # type: dict # Index url -> [lookups, errors, total seconds]
+        self.installs = {}  # type: dict # Package name -> timings of its install phases
+        self.lock_waits = []  # type: list # Seconds spent waiting for soft locks
+
+    def __repr__(self):
+        return "%s events" % self.count
+
+    @property
+    def count(self):
+        """int: Number of events recorded so far"""
+        cache = sum(sum(v) for v in self.cache.values())
+        indexes = sum(v[0] for v in self.indexes.values())
+        return cache + indexes + len(self.installs) + len(self.lock_waits)
+
+    def cache_lookup(self, name, hit):
+        """
+        Args:
+            name (str): Name of cache that was consulted
+            hit (bool): True if cache could be used
+        """
+        counts = self.cache.setdefault(name, [0, 0])
+        counts[0 if hit else 1] += 1
+
+    def index_lookup(self, index, elapsed, failed):
+        """
+        Args:
+            index (str): Index that was queried
+            elapsed (float): Time in seconds the query took
+            failed (bool): True if index could not be reached
+        """
+        counts = self.indexes.setdefault(index, [0, 0, 0.0])
+        counts[0] += 1
+        counts[1] += 1 if failed else 0
+        counts[2] += elapsed
+
+    def installed(self, name, timings):
+        """
+        Args:
+            name (str): Name of package that was installed
+            timings (dict): Time in seconds each install phase took
+        """
+        self.installs[name] = dict(timings)
+
+    def lock_wait(self, elapsed):
+        """
+        Args:
+            elapsed (float): Time in seconds spent waiting for a soft lock
+        """
+        self.lock_waits.append(elapsed)
+
+    def merged_state(self, state):
+        """
+        Args:
+            state (dict): Previously persisted state
+
+        Returns:
+            (dict): 'state' with metrics recorded by current run added to it
+        """
+        cache = state.setdefault("cache", {})
+        for name, (hits, misses) in self.cache.items():
+            counts = cache.setdefault(name, dict(hits=0, misses=0))
+            counts["hits"] += hits
+            counts["misses"] += misses
+
+        indexes = state.setdefault("indexes", {})
+        for index, (lookups, errors, seconds) in self.indexes.items():
+            counts = indexes.setdefault(index, dict(lookups=0, errors=0, seconds=0))
+            counts["lookups"] += lookups
+            counts["errors"] += errors
+            counts["seconds"] = round(counts["seconds"] + seconds, 4)
+
+        installs = state.setdefault("installs", {})
+        for name, timings in self.installs.items():
+            installs[name] = dict((k, round(v, 4)) for k, v in timings.items())
+
+        if self.lock_waits:
+            lock = state.setdefault("lock", dict(waits=0, seconds=0))
+            lock["waits"] += len(self.lock_waits)
+            lock["seconds"] = round(lock["seconds"] + sum(self.lock_waits), 4)
+            lock["last"] = round(self.lock_waits[-1], 4)
+
+        return state
+
+
+METRICS = MetricsCollector()
+
+
+def escaped_label(value):
+    """str: 'value' escaped for use as a Prometheus label value"""
+    return runez.stringified(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class TextfileRenderer(object):
+    """Renders metrics in Prometheus text exposition format"""
+
+    def __init__(self):
+        self.lines = []
+
+    def __str__(self):
+        return "\n".join(self.lines) + "\n"
+
+    def add(self, name, kind, description, samples):
+        """
+        Args:
+            name (str): Metric name (without 'pickley_' prefix)
+            kind (str): Prometheus metric type ('gauge' or 'counter')
+            description (str): Description of metric
+            samples (list): (labels dict, value) tuples
+        """
+        if samples:
+            name = "pickley_%s" % name
+            self.lines.append("# HELP %s %s" % (name, description))
+            self.lines.append("# TYPE %s %s" % (name, kind))
+            for labels, value in samples:
+                if labels:
+                    labels = ",".join('%s="%s"' % (k, escaped_label(v)) for k, v in sorted(labels.items()))
+                    self.lines.append("%s{%s} %s" % (name, labels, value))
+
+                else:
+                    self.lines.append("%s %s" % (name, value))
+
+
+def package_samples(cfg, now):
+    """
+    Args:
+        cfg (pickley.PickleyConfig): Config to use
+        now (float): Current epoch
+
+    Returns:
+        (dict): Metric name -> samples, for each installed package (based on cached info only, no index is queried)
+    """
+    result = dict(info=[], outdated=[], lag=[], check_age=[])
+    for pspec in cfg.package_specs():
+        manifest = pspec.get_manifest()
+        if not manifest or not manifest.version:
+            continue
+
+        labels = dict(package=pspec.dashed)
+        result["info"].append((dict(labels, version=manifest.version), 1))
+        latest_path = cfg.cache.full_path("%s.latest" % pspec.dashed)
+        latest = runez.read_json(latest_path, default={})
+        outdated = latest.get("source") == "latest" and latest.get("version") not in (None, manifest.version)
+        result["outdated"].append((labels, 1 if outdated else 0))
+        first_seen = latest.get("first_seen")
+        result["lag"].append((labels, int(max(now - first_seen, 0)) if outdated and first_seen else 0))
+        if os.path.exists(latest_path):
+            result["check_age"].append((labels, int(max(now - os.path.getmtime(latest_path), 0))))
+
+    return result
+
+
+def rendered_textfile(cfg, state, now=None):
+    """
+    Args:
+        cfg (pickley.PickleyConfig): Config to use
+        state (dict): Persisted metrics state
+        now (float | None): Current epoch (for testing)
+
+    Returns:
+        (str): Metrics in Prometheus text format
+    """
+    if now is None:
+        now = time.time()
+
+    r = TextfileRenderer()
+    packages = package_samples(cfg, now)
+    r.add("package_info", "gauge", "Installed version of package", packages["info"])
+    r.add("package_outdated", "gauge", "1 if a newer version than the installed one is known", packages["outdated"])
+    r.add("package_lag_seconds", "gauge", "Seconds since newer version was first seen, while not installed yet", packages["lag"])
+    r.add("package_check_age_seconds", "gauge", "Seconds since latest version of package was last looked up", packages["check_age"])
+
+    stats = cfg.index_stats()
+    indexes = state.get("indexes", {})
+    names = sorted(set(indexes) | set(stats.stats))
+    r.add("index_latency_seconds", "gauge", "Rolling latency of version lookups", [(dict(index=i), stats.latency(i)) for i in names])
+    r.add("index_error_rate", "gauge", "Rolling error rate of version lookups", [(dict(index=i), stats.error_rate(i)) for i in names])
+    r.add("index_lookups_total", "counter", "Version lookups", [(dict(index=i), v["lookups"]) for i, v in sorted(indexes.items())])
+    r.add("index_lookup_errors_total", "counter", "Failed version lookups", [
+        (dict(index=i), v["errors"]) for i, v in sorted(indexes.items())
+    ])
+    r.add("index_lookup_seconds_total", "counter", "Time spent on version lookups", [
+        (dict(index=i), v["seconds"]) for i, v in sorted(indexes.items())
+    ])
+
+    phases = []
+    for name, timings in sorted(state.get("installs", {}).items()):
+        phases.extend((dict(package=name, phase=phase), value) for phase, value in sorted(timings.items()))
+
+    r.add("install_phase_seconds", "gauge", "Duration of each phase of the last install of package", phases)
+
+    cache = sorted(state.get("cache", {}).items())
+    r.add("cache_hits_total", "counter", "Lookups served from cache", [(dict(cache=k), v["hits"]) for k, v in cache])
+    r.add("cache_misses_total", "counter", "Lookups not served from cache", [(dict(cache=k), v["misses"]) for k, v in cache])
+    r.add("cache_hit_ratio", "gauge", "Ratio of lookups served from cache", [
+        (dict(cache=k), round(float(v["hits"]) / (v["hits"] + v["misses"]), 4)) for k, v in cache if v["hits"] + v["misses"]
+    ])
+
+    lock = state.get("lock")
+    if lock:
+        r.add("lock_waits_total", "counter", "Times a soft lock was acquired", [(None, lock["waits"])])
+        r.add("lock_wait_seconds_total", "counter", "Time spent waiting for soft locks", [(None, lock["seconds"])])
+        r.add("lock_wait_last_seconds", "gauge", "Time spent waiting for the last acquired soft lock", [(None, lock["last"])])
+
+    r.add("metrics_timestamp_seconds", "gauge", "When these metrics were exported", [(None, int(now))])
+    return str(r)
+
+
+def export_metrics(cfg):
+    """
+    Args:
+        cfg (pickley.PickleyConfig): Config to use
+
+    Returns:
+        (str | None): Path to exported textfile, if metrics export is configured
+    """
+    path = cfg.metrics_textfile()
+    if not path or runez.DRYRUN:
+        return None
+
+    from pickley import acquire_fetch_lock, save_json_atomically
+
+    state_path = cfg.cache.full_path("metrics.json")
+    lock_path = "%s.lock" % state_path  # Concurrent read-merge-save of state would lose counter increments
+    cutoff = time.time() + METRICS_LOCK_WAIT
+    while not acquire_fetch_lock(lock_path):
+        if time.time() >= cutoff:
+            LOG.debug("Metrics of this run not exported: %s held by another process", runez.short(lock_path))
+            return None
+
+        time.sleep(0.05)
+
+    try:
+        state = METRICS.merged_state(runez.read_json(state_path, default={}))
+        runez.ensure_folder(os.path.dirname(path), fatal=False, logger=None)
+        tmp = "%s.%s.tmp" % (path, os.getpid())  # node_exporter ignores files not ending with .prom
+        runez.write(tmp, rendered_textfile(cfg, state), fatal=False, logger=None)
+        if not os.path.exists(tmp):
+            LOG.debug("Metrics of this run not exported: could not write %s", runez.short(path))
+            return None
+
+        os.rename(tmp, path)
+        save_json_atomically(state, state_path)  # Persisted only once exported, so that textfile and state agree
+        METRICS.reset()  # Recorded metrics are now part of persisted state
+        return path
+
+    finally:
+        runez.delete(lock_path, fatal=False, logger=None)
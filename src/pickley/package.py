@@ -1,15 +1,35 @@
+import base64
+import glob
+import hashlib
 import logging
 import os
+import random
 import re
+import signal
+import subprocess  # nosec
+import sys
+import tarfile
+import threading
+import time
+import zipfile
 
 import runez
 
 from pickley import abort
 from pickley.delivery import DeliveryMethod
+from pickley.metrics import METRICS
+from pickley.pypi import PepVersion
 
 
 LOG = logging.getLogger(__name__)
 RE_BIN_SCRIPT = re.compile(r"^[./]+/bin/([-a-z0-9_.]+)$", re.IGNORECASE)
+PIP_BIN_SCRIPT_OWNERS = {"easy_install": "setuptools", "pip": "pip", "wheel": "wheel"}
+RE_PIP_BIN_SCRIPT = re.compile(r"^(pip|easy_install|wheel)(-?[0-9.]+)?$")
+RE_PIP_SITE_PACKAGE = re.compile(r"^(pip|setuptools|wheel|pkg_resources|_distutils_hack|easy_install)([-.].*)?$")
+RE_REQUIRES_DIST = re.compile(r"^Requires-Dist:\s*([a-z0-9._-]+)", re.IGNORECASE)
+PIP_MODES = ("ensurepip", "shared", "wheel")
+PIP_WHEEL_MAX_AGE = 7 * 24 * 60 * 60  # Age in seconds after which to download a more recent pip wheel, if available
+STRIP_RULES = ("sources", "pycache", "pip", "tests", "docs", "headers")  # In order of application
 
 
 def clean_folder(folder):
@@ -26,6 +46,555 @@ def clean_folder(folder):
         runez.ensure_folder(folder)
 
 
+def killed_process_group(pid):
+    """
+    Args:
+        pid (int): Pid of process group leader to kill (along with everything it spawned)
+
+    Returns:
+        (bool): True if process group was still running, and got killed
+    """
+    try:
+        os.killpg(pid, signal.SIGKILL)
+        return True
+
+    except OSError:  # pragma: no cover, process exited in the meantime
+        return False
+
+
+def run_with_timeout(timeout, program, *args, **kwargs):
+    """Same as runez.run(), but kill 'program' (and anything it spawned) if it runs for more than 'timeout' seconds
+
+    Args:
+        timeout (int | float | None): Timeout in seconds, no timeout enforced if None or 0
+        program (str): Program to run
+        *args: Command line args to call 'program' with
+        **kwargs: Passed through to runez.run(), only 'fatal' and 'logger' are supported when a timeout is given
+
+    Returns:
+        (runez.program.RunResult): Run outcome, '.timed_out' is True if 'program' had to be killed
+    """
+    if not timeout or runez.DRYRUN:
+        return runez.run(program, *args, **kwargs)
+
+    fatal = kwargs.pop("fatal", True)
+    logger = kwargs.pop("logger", LOG.debug)
+    args = runez.flattened(args, shellify=True)
+    full_path = runez.which(program) or program
+    description = "%s %s" % (runez.short(full_path), runez.quoted(args))
+    if logger:
+        logger("Running: %s" % description)
+
+    result = runez.program.RunResult()
+    result.timed_out = False
+    if sys.version_info[0] >= 3:
+        kwargs = dict(start_new_session=True)
+
+    else:  # pragma: no cover
+        kwargs = dict(preexec_fn=os.setsid)
+
+    try:
+        p = subprocess.Popen([full_path] + args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, **kwargs)  # nosec
+
+    except OSError as e:
+        result.error = "%s failed: %s" % (runez.short(program), e)
+        return runez.abort(result.error, return_value=result, fatal=fatal, logger=logger)
+
+    def kill_process_group():
+        result.timed_out = True
+        killed_process_group(p.pid)
+
+    timer = threading.Timer(timeout, kill_process_group)
+    timer.start()
+    try:
+        out, err = p.communicate()
+
+    except BaseException:
+        # Ctrl-C or abort: child runs in its own session (it doesn't get the terminal's SIGINT), don't leave it running orphaned
+        killed_process_group(p.pid)
+        p.wait()
+        raise
+
+    finally:
+        timer.cancel()
+
+    result.output = runez.decode(out, strip=True)
+    result.error = runez.decode(err, strip=True)
+    result.pid = p.pid
+    result.exit_code = p.returncode
+    if result.timed_out:
+        result.error = "%s timed out after %s" % (runez.short(program), runez.represented_duration(timeout))
+
+    if fatal and result.exit_code:
+        return runez.abort(result.error or "%s exited with code %s" % (runez.short(program), result.exit_code), fatal=fatal)
+
+    return result
+
+
+def cached_pip_wheel(cache, python, index, offline=False, timeout=None):
+    """
+    Args:
+        cache (str): Folder where to cache pip wheels
+        python (pickley.env.PythonInstallation): Python that will use the pip wheel
+        index (str | None): Optional custom pypi index to use
+        offline (bool): If True, don't try to download a pip wheel, use whichever one is already cached
+        timeout (int | float | None): Max time in seconds the download of a pip wheel can take, hung download gets killed
+
+    Returns:
+        (str): Path to most recent pip wheel usable by 'python' (downloaded if not already in cache)
+    """
+    folder = os.path.join(cache, "pip-wheels", "py%s.%s" % (python.major, python.minor))
+    wheels = cached_wheels(folder, "pip")
+    if offline:
+        if not wheels and not runez.DRYRUN:
+            abort("No pip wheel cached in %s, can't download one in offline mode" % runez.red(runez.short(folder)))
+
+    elif not wheels or not runez.file.is_younger(wheels[-1], PIP_WHEEL_MAX_AGE):
+        run_with_timeout(
+            timeout, sys.executable, "-mpip", "download", "-q", "--no-deps", "--only-binary", ":all:",
+            "--python-version", "%s.%s" % (python.major, python.minor), "-i", index, "-d", folder, "pip",
+            fatal=not wheels,  # Failing to refresh is OK, as long as we already have a wheel
+        )
+        wheels = cached_wheels(folder, "pip") or wheels
+
+    if wheels:
+        return wheels[-1]
+
+    return os.path.join(folder, "pip.whl")  # pragma: no cover, dryrun mode
+
+
+def shared_pip(cache, python, index, offline=False, timeout=None):
+    """
+    Args:
+        cache (str): Folder where to cache pip wheels, and shared pip installations
+        python (pickley.env.PythonInstallation): Python that will run the shared pip
+        index (str | None): Optional custom pypi index to use
+        offline (bool): If True, don't try to download a pip wheel, use whichever one is already cached
+        timeout (int | float | None): Max time in seconds the download of a pip wheel can take, hung download gets killed
+
+    Returns:
+        (str): Path to runnable pip, unpacked from cached pip wheel, which can be used by any venv of 'python'
+    """
+    pip_wheel = cached_pip_wheel(cache, python, index, offline=offline, timeout=timeout)
+    target = os.path.join(cache, "pip", os.path.basename(pip_wheel)[:-4])
+    if not os.path.isdir(target) and not runez.DRYRUN:
+        tmp = "%s.%s.tmp" % (target, os.getpid())
+        with zipfile.ZipFile(pip_wheel) as z:
+            z.extractall(tmp)
+
+        try:
+            os.rename(tmp, target)  # Atomic, concurrent pickley runs never see a partially unpacked pip
+
+        except OSError:  # pragma: no cover, another pickley run unpacked it in the meantime
+            runez.delete(tmp, logger=None)
+
+    return os.path.join(target, "pip")
+
+
+def cached_wheels(folder, name):
+    """
+    Args:
+        folder (str): Folder to examine
+        name (str): Wheelified name of package to look for
+
+    Returns:
+        (list): Wheels for 'name' found in 'folder', sorted by version
+    """
+    result = []
+    for path in glob.glob(os.path.join(folder, "%s-*.whl" % name)):
+        version = PepVersion(os.path.basename(path).split("-")[1])
+        if version.components:
+            result.append((version, path))
+
+    return [path for _, path in sorted(result)]
+
+
+def site_packages_folders(venv_folder):
+    """
+    Args:
+        venv_folder (str): Path to venv
+
+    Returns:
+        (list): Path to site-packages folder(s) of venv
+    """
+    return sorted(glob.glob(os.path.join(venv_folder, "lib", "python*", "site-packages")))
+
+
+def venv_fingerprint(folder, pspec):
+    """
+    Args:
+        folder (str): Path to venv
+        pspec (pickley.PackageSpec): Package spec the venv was created for
+
+    Returns:
+        (dict): What identifies the contents of venv: python used, index installed from, settings shaping the venv,
+                and hash of all RECORD files
+    """
+    records = hashlib.sha256()
+    for site_packages in site_packages_folders(folder):
+        for path in sorted(glob.glob(os.path.join(site_packages, "*.dist-info", "RECORD"))):
+            records.update(os.path.relpath(path, folder).encode("utf-8"))
+            with open(path, "rb") as fh:
+                records.update(fh.read())
+
+    return dict(
+        python=pspec.python.executable,
+        python_version=str(pspec.python.version),
+        index=" ".join(pspec.cfg.indexes(pspec)),  # Equivalent mirrors are interchangeable
+        pip_mode=pspec.cfg.pip_mode(pspec) or "ensurepip",
+        precompile=pspec.cfg.precompile(pspec),
+        records=records.hexdigest(),
+    )
+
+
+def save_venv_fingerprint(folder, pspec):
+    """Remember fingerprint of freshly installed venv in 'folder', see 'reusable_venv()'"""
+    runez.save_json(venv_fingerprint(folder, pspec), os.path.join(folder, ".fingerprint.json"), keep_none=True, logger=None)
+
+
+def reusable_venv(folder, pspec):
+    """
+    Args:
+        folder (str): Path to venv
+        pspec (pickley.PackageSpec): Package spec (with a version) about to be installed in 'folder'
+
+    Returns:
+        (bool): True if 'folder' holds an intact venv built with same python, index and settings as 'pspec' (no need to rebuild it)
+    """
+    fingerprint = runez.read_json(os.path.join(folder, ".fingerprint.json"), default=None)
+    if not fingerprint or not runez.is_executable(os.path.join(folder, "bin", "python")):
+        return False
+
+    if fingerprint != venv_fingerprint(folder, pspec):
+        LOG.debug("Venv %s was modified, or has a different python, index or settings, not reusing it", runez.short(folder))
+        return False
+
+    problems = record_problems(folder)
+    if problems:
+        LOG.debug("Venv %s is not intact (%s), not reusing it", runez.short(folder), ", ".join(problems))
+        return False
+
+    return True
+
+
+def record_problems(venv_folder, sample=None):
+    """
+    Args:
+        venv_folder (str): Path to venv
+        sample (int | None): If specified, verify hashes of only that percentage of files (randomly picked)
+
+    Returns:
+        (list): Files from venv's RECORD files that are missing, or have different contents than what was installed
+    """
+    problems = []
+    for site_packages in site_packages_folders(venv_folder):
+        for record in glob.glob(os.path.join(site_packages, "*.dist-info", "RECORD")):
+            for line in runez.readlines(record, default=[]):
+                relative_path, _, checksum = line.partition(",")
+                checksum = checksum.partition(",")[0]
+                if not relative_path:
+                    continue
+
+                path = os.path.join(site_packages, relative_path)
+                if not os.path.exists(path):
+                    problems.append("missing %s" % relative_path)
+
+                elif checksum and not relative_path.startswith(".."):  # Scripts in bin/ may have been relocated
+                    if sample is None or random.randint(1, 100) <= sample:  # nosec, not used for security
+                        algo, _, expected = checksum.partition("=")
+                        with open(path, "rb") as fh:
+                            digest = hashlib.new(algo, fh.read()).digest()
+
+                        if base64.urlsafe_b64encode(digest).rstrip(b"=").decode("ascii") != expected:
+                            problems.append("modified %s" % relative_path)
+
+    return problems
+
+
+def path_size(path):
+    """
+    Args:
+        path (str): Path to file or folder
+
+    Returns:
+        (int, int): Number of files, and their total size in bytes
+    """
+    if os.path.islink(path) or not os.path.isdir(path):
+        return 1, os.lstat(path).st_size
+
+    files = size = 0
+    for dirpath, _, filenames in os.walk(path):
+        for fname in filenames:
+            files += 1
+            size += os.lstat(os.path.join(dirpath, fname)).st_size
+
+    return files, size
+
+
+class VenvStripper(object):
+    """Removes files that are not needed at runtime from a packaged venv, to reduce its size"""
+
+    def __init__(self, folder, rules):
+        """
+        Args:
+            folder (str): Path to venv to strip
+            rules (list): Rules to apply, see STRIP_RULES
+        """
+        self.folder = folder
+        self.rules = [r for r in STRIP_RULES if r in rules]
+        self.site_packages = site_packages_folders(folder)
+
+    def __repr__(self):
+        return "%s [%s]" % (runez.short(self.folder), ", ".join(self.rules))
+
+    def strip(self):
+        """
+        Returns:
+            (list): Tuples (rule, number of files removed, bytes saved) for each applied rule
+        """
+        result = []
+        for rule in self.rules:
+            files = size = 0
+            for path in getattr(self, "_%s_paths" % rule)():
+                f, s = path_size(path)
+                files += f
+                size += s
+                runez.delete(path, logger=None)
+
+            LOG.debug("Strip rule '%s' removed %s files (%s) from %s", rule, files, runez.represented_bytesize(size), self)
+            result.append((rule, files, size))
+
+        return result
+
+    def _nested_folders(self, *names):
+        """Folders with given 'names', that are nested within a top-level package in site-packages"""
+        for sp in self.site_packages:
+            for dirpath, dirnames, _ in os.walk(sp):
+                if dirpath != sp:
+                    for dirname in dirnames:
+                        if dirname in names:
+                            yield os.path.join(dirpath, dirname)
+
+                    dirnames[:] = [d for d in dirnames if d not in names]
+
+    def _required_dists(self):
+        """Names of dists other installed dists depend on, according to their metadata"""
+        result = set()
+        for sp in self.site_packages:
+            for metadata in glob.glob(os.path.join(sp, "*.dist-info", "METADATA")):
+                for line in runez.readlines(metadata, default=[], errors="ignore"):
+                    m = RE_REQUIRES_DIST.match(line)
+                    if m:
+                        result.add(m.group(1).lower().replace("_", "-"))
+
+        return result
+
+    def _docs_paths(self):
+        for path in self._nested_folders("doc", "docs"):
+            yield path
+
+        for name in ("doc", "man"):
+            path = os.path.join(self.folder, "share", name)
+            if os.path.isdir(path):
+                yield path
+
+    def _headers_paths(self):
+        path = os.path.join(self.folder, "include")
+        if os.path.isdir(path):
+            yield path
+
+    def _pip_paths(self):
+        required = self._required_dists()
+        kept = set(n for n in ("pip", "setuptools", "wheel") if n in required)
+        if "setuptools" in kept:
+            kept.update(("pkg_resources", "_distutils_hack", "easy_install"))
+
+        for sp in self.site_packages:
+            for fname in sorted(os.listdir(sp)):
+                m = RE_PIP_SITE_PACKAGE.match(fname)
+                if m and m.group(1) not in kept:
+                    yield os.path.join(sp, fname)
+
+            pth = os.path.join(sp, "distutils-precedence.pth")
+            if "setuptools" not in kept and os.path.exists(pth):
+                yield pth
+
+        bin_folder = os.path.join(self.folder, "bin")
+        if os.path.isdir(bin_folder):
+            for fname in sorted(os.listdir(bin_folder)):
+                m = RE_PIP_BIN_SCRIPT.match(fname)
+                if m and PIP_BIN_SCRIPT_OWNERS[m.group(1)] not in kept:
+                    yield os.path.join(bin_folder, fname)
+
+    def _pycache_paths(self):
+        for sp in self.site_packages:
+            for dirpath, dirnames, _ in os.walk(sp):
+                if "__pycache__" in dirnames:
+                    dirnames.remove("__pycache__")
+                    yield os.path.join(dirpath, "__pycache__")
+
+    def _sources_paths(self):
+        """.py files that have a compiled .pyc, which gets moved to legacy location (so it's importable without its source)"""
+        for sp in self.site_packages:
+            for dirpath, _, filenames in os.walk(sp):
+                if os.path.basename(dirpath) != "__pycache__":
+                    continue
+
+                folder = os.path.dirname(dirpath)
+                for fname in filenames:
+                    parts = fname.split(".")
+                    source = os.path.join(folder, "%s.py" % parts[0])
+                    if len(parts) == 3 and parts[2] == "pyc" and os.path.isfile(source):  # Skip optimized .opt-N.pyc files
+                        if not runez.DRYRUN:
+                            os.rename(os.path.join(dirpath, fname), os.path.join(folder, "%s.pyc" % parts[0]))
+
+                        yield source
+
+    def _tests_paths(self):
+        return self._nested_folders("test", "tests")
+
+
+def is_escaping_path(path):
+    """bool: True if relative tarball 'path' could end up outside of the folder it gets extracted into"""
+    return not path or os.path.isabs(path) or ".." in path.replace("\\", "/").split("/")
+
+
+class VenvStore(object):
+    """Shared folder (NFS mount for example) holding relocatable tarballs of built venvs, reusable across hosts"""
+
+    origin_header = "pickley.origin"  # Tarball PAX header holding path of venv at the time it was packed
+
+    def __init__(self, folder):
+        """
+        Args:
+            folder (str): Path to shared folder
+        """
+        self.folder = folder
+
+    def __repr__(self):
+        return runez.short(self.folder)
+
+    def artifact_path(self, pspec):
+        """
+        Args:
+            pspec (pickley.PackageSpec): Package spec (with a version)
+
+        Returns:
+            (str): Path to tarball of venv for 'pspec', built with same python, index and venv-shaping settings
+        """
+        python = pspec.python
+        cfg = pspec.cfg
+        key = "%s %s %s pip_mode=%s precompile=%s" % (
+            python.executable, python.version, " ".join(cfg.indexes(pspec)), cfg.pip_mode(pspec) or "ensurepip", cfg.precompile(pspec)
+        )
+        key = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]  # nosec, not used for security
+        return os.path.join(self.folder, pspec.dashed, "%s-%s-py%s-%s.tar.gz" % (pspec.dashed, pspec.version, python.version, key))
+
+    def publish(self, pspec, venv):
+        """
+        Args:
+            pspec (pickley.PackageSpec): Package spec (with a version)
+            venv (PythonVenv): Successfully built venv for 'pspec'
+        """
+        path = self.artifact_path(pspec)
+        if runez.DRYRUN or os.path.exists(path):
+            return
+
+        runez.ensure_folder(os.path.dirname(path), logger=None)
+        tmp = "%s.%s.tmp" % (path, os.getpid())
+        try:
+            with tarfile.open(tmp, "w:gz", format=tarfile.PAX_FORMAT, pax_headers={self.origin_header: venv.folder}) as tar:
+                tar.add(venv.folder, arcname=".")
+
+            os.rename(tmp, path)  # Atomic, other hosts never see a partially written tarball
+            LOG.debug("Published %s to %s", runez.short(venv.folder), runez.short(path))
+
+        except Exception as e:  # pragma: no cover, store not writable, or full
+            LOG.warning("Could not publish %s to venv store: %s", pspec, e)
+            runez.delete(tmp, fatal=False, logger=None)
+
+    def unpack(self, pspec, target):
+        """
+        Args:
+            pspec (pickley.PackageSpec): Package spec (with a version)
+            target (str): Folder where to unpack venv
+
+        Returns:
+            (bool): True if a prebuilt venv was found, and unpacked in 'target'
+        """
+        path = self.artifact_path(pspec)
+        if runez.DRYRUN or not os.path.exists(path):
+            return False
+
+        clean_folder(target)
+        try:
+            with tarfile.open(path, "r:gz") as tar:
+                origin = tar.pax_headers.get(self.origin_header)
+                members = tar.getmembers()
+                for member in members:
+                    problem = self._unsafe_member(member, pspec.python)
+                    if problem:
+                        raise Exception("%s '%s' in tarball" % (problem, member.name))
+
+                tar.extractall(target, members=members)  # nosec, member paths, types and link targets verified above
+
+            if origin and origin != target:
+                self._relocate(target, origin)
+
+            LOG.debug("Unpacked %s from %s", runez.short(target), runez.short(path))
+            return True
+
+        except Exception as e:
+            LOG.warning("Could not use prebuilt venv %s: %s", runez.short(path), e)
+            clean_folder(target)
+            return False
+
+    @staticmethod
+    def _unsafe_member(member, python):
+        """
+        Args:
+            member (tarfile.TarInfo): Tarball member to inspect
+            python (pickley.env.PythonInstallation): Python the venv was built with
+
+        Returns:
+            (str | None): Why 'member' can't be safely extracted, if applicable
+        """
+        if is_escaping_path(member.name):
+            return "unsafe path"
+
+        if member.isdev():
+            return "unsupported type for"
+
+        if member.islnk() and is_escaping_path(member.linkname):
+            return "unsafe hard link"
+
+        if member.issym():
+            if os.path.isabs(member.linkname):
+                # Only link allowed to point outside of venv is bin/python, to the interpreter the venv was built with
+                if member.linkname not in (python.executable, os.path.realpath(python.executable)):
+                    return "unsafe symlink"
+
+            elif is_escaping_path(os.path.normpath(os.path.join(os.path.dirname(member.name), member.linkname))):
+                return "unsafe symlink"
+
+    @staticmethod
+    def _relocate(target, origin):
+        """Rewrite references to 'origin' folder in bin/ scripts and pyvenv.cfg"""
+        origin = origin.encode("utf-8")
+        relocated = target.encode("utf-8")
+        bin_folder = os.path.join(target, "bin")
+        paths = [os.path.join(target, "pyvenv.cfg")]
+        paths.extend(os.path.join(bin_folder, fname) for fname in os.listdir(bin_folder))
+        for path in paths:
+            if os.path.isfile(path) and not os.path.islink(path):
+                with open(path, "rb") as fh:
+                    contents = fh.read()
+
+                if origin in contents and b"\0" not in contents[:1024]:  # Text files only
+                    with open(path, "wb") as fh:
+                        fh.write(contents.replace(origin, relocated))
+
+
 def entry_points_from_txt(path):
     metadata = runez.file.ini_to_dict(path, default={})
     return metadata.get("console_scripts")
@@ -36,25 +605,140 @@ def entry_points_from_metadata(path):
     return metadata.get("extensions", {}).get("python.commands", {}).get("wrap_console")
 
 
+def wheel_entry_points(path):
+    """
+    Args:
+        path (str): Path to a wheel, inspected without being extracted
+
+    Returns:
+        (dict | None): Console scripts (or bin scripts) the wheel would install, if any
+    """
+    result = None
+    with zipfile.ZipFile(path) as zf:
+        for name in zf.namelist():
+            folder, _, fname = name.partition("/")
+            if folder.endswith(".dist-info") and fname == "entry_points.txt":
+                section = None
+                for line in zf.read(name).decode("utf-8", "ignore").splitlines():
+                    line = line.strip()
+                    if line.startswith("[") and line.endswith("]"):
+                        section = line.strip("[]").strip()
+
+                    elif section == "console_scripts" and "=" in line:
+                        key, _, value = line.partition("=")
+                        result = result or {}
+                        result[key.strip()] = value.strip()
+
+            elif folder.endswith(".data") and fname.startswith("scripts/") and fname != "scripts/":
+                result = result or {}
+                result[os.path.basename(fname)] = name
+
+    return result
+
+
+def local_wheel(pspec, *folders):
+    """
+    Args:
+        pspec (pickley.PackageSpec): Package spec to look for (at version 'pspec.version')
+        *folders (str | None): Folders to look in (None entries are ignored)
+
+    Returns:
+        (str | None): Path to already downloaded wheel for 'pspec', if any
+    """
+    prefix = ("%s-%s-" % (pspec.wheelified, pspec.version)).lower()
+    for folder in folders:
+        if folder and os.path.isdir(folder):
+            for fname in sorted(os.listdir(folder)):
+                if fname.endswith(".whl") and fname.lower().startswith(prefix):
+                    return os.path.join(folder, fname)
+
+
 def first_line(path):
     """str: First line of file with 'path', if any"""
     for line in runez.readlines(path, default=[], errors="ignore"):
         return line
 
 
+def not_a_cli(pspec):
+    """Abort installation of 'pspec', cleaning up its meta folder"""
+    runez.delete(pspec.meta_path)
+    abort("Can't install '%s', it is %s" % (runez.bold(pspec.dashed), runez.red("not a CLI")))
+
+
+def pspec_venv(folder, pspec, create=True):
+    """
+    Args:
+        folder (str): Target folder
+        pspec (pickley.PackageSpec): Package spec whose configuration determines how venv should be created
+        create (bool): If False, refer to an already existing venv in 'folder'
+
+    Returns:
+        (PythonVenv): Created venv
+    """
+    cfg = pspec.cfg
+    return PythonVenv(
+        folder, pspec.python, pspec.index,
+        pip_mode=cfg.pip_mode(pspec), cache=cfg.cache.path, wheelhouse=pspec.prefetched or cfg.wheelhouse(pspec), create=create,
+        timeout=cfg.install_timeout(pspec) * 60, offline=cfg.offline(),
+    )
+
+
+def build_wheels(pspec, wheelhouse):
+    """
+    Args:
+        pspec (pickley.PackageSpec): Package spec (with a version) to build wheels for, including all its dependencies
+        wheelhouse (str): Folder where to deposit wheels
+
+    Returns:
+        (runez.program.RunResult): Outcome of 'pip wheel' run
+    """
+    pip = shared_pip(pspec.cfg.cache.path, pspec.python, pspec.index, timeout=pspec.cfg.install_timeout(pspec) * 60)
+    tmp = os.path.join(wheelhouse, ".tmp-%s-%s" % (pspec.dashed, os.getpid()))  # Per run: concurrent runs don't clobber each other
+    r = pspec.python.run(
+        pip, "wheel", "-q", "-i", pspec.index, "--find-links", wheelhouse, "--wheel-dir", tmp, pspec.specced, fatal=False
+    )
+    if os.path.isdir(tmp):
+        for fname in os.listdir(tmp):
+            target = os.path.join(wheelhouse, fname)
+            if not os.path.exists(target):
+                os.rename(os.path.join(tmp, fname), target)
+
+        runez.delete(tmp, logger=None)
+
+    return r
+
+
 class PythonVenv(object):
-    def __init__(self, folder, python, index):
+    def __init__(self, folder, python, index, pip_mode=None, cache=None, wheelhouse=None, create=True, timeout=None, offline=False):
         """
         Args:
             folder (str): Target folder (empty string for testing, venv is not actually created in that case)
             python (pickley.env.PythonInstallation): Python to use
             index (str | None): Optional custom pypi index to use
+            pip_mode (str | None): How to provide pip to this venv, one of PIP_MODES (default: ensurepip)
+            cache (str | None): Folder where to cache pip wheels, required for pip modes other than 'ensurepip'
+            wheelhouse (str | None): Optional local folder to install from, instead of 'index'
+            create (bool): If False, refer to an already existing venv in 'folder' (don't create it)
+            timeout (int | None): Max time in seconds all subprocesses ran on this venv can take, hung processes get killed
+            offline (bool): If True, don't download anything (pip itself must already be cached, for pip modes that need it)
         """
         self.folder = folder
+        self.timeout = timeout
+        self.deadline = timeout and time.time() + timeout
         self.python = python
         self.index = index
+        self.wheelhouse = wheelhouse
+        self.pip_mode = pip_mode or "ensurepip"
+        self.pip_command = "-mpip"  # How to invoke pip with this venv's python
         self.py_path = self.bin_path("python")
-        if folder:
+        if self.pip_mode not in PIP_MODES:
+            abort("Unknown pip mode '%s'" % runez.red(self.pip_mode))
+
+        if self.pip_mode == "shared":
+            # Venv has no pip of its own, pip is ran from a shared location (and installs in the venv of the python running it)
+            self.pip_command = shared_pip(cache, python, index, offline=offline, timeout=self.remaining_time())
+
+        if folder and create:
             if python.problem:
                 abort("Python '%s' is not usable: %s" % (runez.bold(python), runez.red(python.problem)))
 
@@ -73,10 +757,25 @@ class PythonVenv(object):
 
                 cmd.append(folder)
                 with runez.Anchored(os.path.dirname(vpath)):
-                    runez.run(*cmd)
+                    self._run_watched("venv creation", *cmd)
+
+            elif self.pip_mode == "ensurepip":
+                self._run_watched("venv creation", python.executable, "-mvenv", folder)
 
             else:
-                python.run("-mvenv", folder)
+                # Skip ensurepip (which unpacks pip and setuptools every time)
+                self._run_watched("venv creation", python.executable, "-mvenv", "--without-pip", folder)
+                if self.pip_mode == "wheel":
+                    pip_wheel = cached_pip_wheel(cache, python, index, offline=offline, timeout=self.remaining_time())
+                    self.run_python(os.path.join(pip_wheel, "pip"), "install", "-q", "--no-index", pip_wheel)
+
+    def remaining_time(self):
+        """
+        Returns:
+            (float | None): Seconds left before this venv's install timeout is reached, if any (at least 1)
+        """
+        if self.deadline:
+            return max(self.deadline - time.time(), 1)
 
     def bin_path(self, name):
         """
@@ -88,6 +787,22 @@ class PythonVenv(object):
         """
         return os.path.join(self.folder, "bin", name)
 
+    def compile_bytecode(self, workers):
+        """
+        Args:
+            workers (int): Number of parallel processes to use (0: one per CPU)
+
+        Returns:
+            (runez.program.RunResult | None): Outcome of compileall run on this venv's site-packages, if any
+        """
+        folders = site_packages_folders(self.folder)
+        if folders:
+            args = ["-mcompileall", "-q"]
+            if self.python.major != 2:  # -j is only available with python3
+                args.append("-j%s" % workers)
+
+            return self.run_python(args, folders, fatal=False)
+
     def find_entry_points(self, pspec):
         """
         Args:
@@ -99,7 +814,7 @@ class PythonVenv(object):
         if runez.DRYRUN:
             return {pspec.dashed: "dryrun"}  # Pretend an entry point exists in dryrun mode
 
-        r = self.run_python("-mpip", "show", "-f", pspec.dashed, fatal=False, logger=None)
+        r = self.run_python(self.pip_command, "show", "-f", pspec.dashed, fatal=False, logger=None)
         if r.succeeded:
             expected_shebang = "#!%s" % runez.quoted(os.path.dirname(self.py_path), adapter=None)
             location = None
@@ -150,20 +865,60 @@ class PythonVenv(object):
 
         return shebang
 
+    def index_args(self):
+        """
+        Returns:
+            (list): pip args stating where to get packages from
+        """
+        if self.wheelhouse:
+            return ["--no-index", "--find-links", self.wheelhouse]
+
+        return ["-i", self.index]
+
     def pip_install(self, *args, **kwargs):
         """Allows to not forget to state the -i index..."""
-        return self._run_pip("install", "-i", self.index, *args, **kwargs)
+        return self._run_pip("install", self.index_args(), *args, **kwargs)
 
     def pip_wheel(self, *args, **kwargs):
         """Allows to not forget to state the -i index..."""
-        return self._run_pip("wheel", "-i", self.index, *args, **kwargs)
+        return self._run_pip("wheel", self.index_args(), *args, **kwargs)
 
     def run_python(self, *args, **kwargs):
         """Run python from this venv with given args"""
-        return runez.run(self.py_path, *args, **kwargs)
+        phase = kwargs.pop("phase", "python %s" % runez.flattened(args)[0])
+        return self._run_watched(phase, self.py_path, *args, **kwargs)
 
     def _run_pip(self, *args, **kwargs):
-        return self.run_python("-mpip", "-v", *args, **kwargs)
+        return self.run_python(self.pip_command, "-v", *args, phase="pip %s" % args[0], **kwargs)
+
+    def _run_watched(self, phase, program, *args, **kwargs):
+        """
+        Args:
+            phase (str): Description of what 'program' is doing, for reporting
+            program (str): Program to run
+            *args: Command line args to call 'program' with
+            **kwargs: Passed through to runez.run()
+
+        Returns:
+            (runez.program.RunResult): Run outcome (aborts if this venv's 'timeout' is reached, after cleaning up partial venv)
+        """
+        if not self.deadline:
+            return runez.run(program, *args, **kwargs)
+
+        fatal = kwargs.pop("fatal", True)
+        r = run_with_timeout(self.remaining_time(), program, *args, fatal=False, **kwargs)
+        if getattr(r, "timed_out", False):
+            if self.folder:
+                runez.delete(self.folder, logger=None)
+
+            abort("%s hung, killed it after install timeout of %s, cleaned up %s" % (
+                runez.red(phase), runez.represented_duration(self.timeout), runez.short(self.folder)
+            ))
+
+        if fatal and r.failed:
+            abort("%s failed: %s" % (runez.red(phase), r.full_output or "exit code %s" % r.exit_code))
+
+        return r
 
 
 class Packager:
@@ -192,6 +947,19 @@ class Packager:
         """
         raise NotImplementedError("Packaging with packager '{packager}' is not supported")
 
+    @staticmethod
+    def strip(dist_folder, rules):
+        """Remove files not needed at runtime from packaged 'dist_folder'
+
+        Args:
+            dist_folder (str): Folder where package was produced
+            rules (list): Strip rules to apply, see STRIP_RULES
+
+        Returns:
+            (list): Tuples (rule, number of files removed, bytes saved) for each applied rule
+        """
+        raise NotImplementedError("Stripping with packager '{packager}' is not supported")
+
 
 class PexPackager(Packager):
     """Package via pex (https://pypi.org/project/pex/)"""
@@ -228,19 +996,70 @@ class VenvPackager(Packager):
         assert pspec.version
         delivery = DeliveryMethod.delivery_method_by_name(pspec.settings.delivery)
         target = pspec.install_path
-        venv = PythonVenv(target, pspec.python, pspec.index)
-        venv.pip_install(pspec.specced)
+        if reusable_venv(target, pspec):
+            # Same venv is already there (for example: 'install --force'), only delivery and manifest need to be redone
+            venv = pspec_venv(target, pspec, create=False)
+            entry_points = venv.find_entry_points(pspec)
+            if entry_points:
+                LOG.debug("Reusing existing venv %s", runez.short(target))
+                METRICS.cache_lookup("venv", hit=True)
+                return delivery.install(pspec, venv, entry_points)
+
+        store = pspec.cfg.venv_store(pspec)
+        started = time.time()
+        if store and store.unpack(pspec, target):
+            venv = pspec_venv(target, pspec, create=False)
+            entry_points = venv.find_entry_points(pspec)
+            if entry_points:
+                pspec.timings["unpack"] = time.time() - started
+                save_venv_fingerprint(target, pspec)
+                METRICS.cache_lookup("venv", hit=True)
+                return delivery.install(pspec, venv, entry_points)
+
+        METRICS.cache_lookup("venv", hit=False)
+
+        wheel = local_wheel(pspec, pspec.prefetched, pspec.cfg.wheelhouse(pspec))
+        if not wheel and pspec.cfg.offline() and not runez.DRYRUN:
+            folders = [runez.short(f) for f in (pspec.prefetched, pspec.cfg.wheelhouse(pspec)) if f]
+            where = "in %s" % ", ".join(folders) if folders else "(no wheelhouse configured)"
+            abort("Can't install %s v%s in offline mode: no wheel found %s" % (pspec.dashed, pspec.version, runez.red(where)))
+
+        if wheel and not wheel_entry_points(wheel):
+            not_a_cli(pspec)
+
+        started = time.time()
+        venv = pspec_venv(target, pspec)
+        pspec.timings["venv"] = time.time() - started
+        started = time.time()
+        workers = pspec.cfg.precompile(pspec)
+        if workers is None:
+            venv.pip_install(pspec.specced)
+
+        else:
+            venv.pip_install("--no-compile", pspec.specced)  # Compiled below, in parallel
+
+        pspec.timings["pip"] = time.time() - started
         entry_points = venv.find_entry_points(pspec)
         if not entry_points:
-            runez.delete(pspec.meta_path)
-            abort("Can't install '%s', it is %s" % (runez.bold(pspec.dashed), runez.red("not a CLI")))
+            not_a_cli(pspec)
+
+        if workers is not None:
+            started = time.time()
+            venv.compile_bytecode(workers)
+            pspec.timings["precompile"] = time.time() - started
 
+        if store:
+            started = time.time()
+            store.publish(pspec, venv)
+            pspec.timings["publish"] = time.time() - started
+
+        save_venv_fingerprint(target, pspec)
         return delivery.install(pspec, venv, entry_points)
 
     @staticmethod
     def package(pspec, build_folder, dist_folder, requirements):
         clean_folder(dist_folder)
-        venv = PythonVenv(dist_folder, pspec.python, pspec.index)
+        venv = pspec_venv(dist_folder, pspec)
         venv.pip_install(*requirements)
         entry_points = venv.find_entry_points(pspec)
         if entry_points:
@@ -249,3 +1068,7 @@ class VenvPackager(Packager):
                 result.append(venv.bin_path(name))
 
             return result
+
+    @staticmethod
+    def strip(dist_folder, rules):
+        return VenvStripper(dist_folder, rules).strip()
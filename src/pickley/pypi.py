@@ -1,14 +1,26 @@
+import hashlib
 import json
 import logging
 import os
+import random
 import re
+import time
 
 import requests
+import runez
+
+from pickley.metrics import METRICS
 
 
 LOG = logging.getLogger(__name__)
 RE_BASENAME = re.compile(r'href=".+/([^/#]+)\.(tar\.gz|whl)#', re.IGNORECASE)
 RE_VERSION = re.compile(r"^((\d+)((\.(\d+))+)((a|b|c|rc)(\d+))?(\.(dev|post)(\d+))?).*$")
+REQUEST_RETRIES = 2  # How many times to retry transient index errors (connection refused/reset, 5xx)
+REQUEST_BACKOFF = 0.5  # Base delay in seconds between retries, doubled on each attempt (with random jitter)
+BREAKER_THRESHOLD = 3  # Number of consecutive failed lookups after which an index is considered down
+BREAKER_COOLDOWN = 10 * 60  # Seconds during which an index considered down is not queried anymore
+STATS_WEIGHT = 0.3  # Weight of latest lookup in rolling index latency/error rate (exponential moving average)
+STATS_UNHEALTHY = 0.5  # Error rate from which an index mirror is considered unhealthy
 
 
 class PepVersion(object):
@@ -62,13 +74,136 @@ class PepVersion(object):
             return self.components < other.components
 
 
-def request_get(url):
-    try:
-        r = requests.get(url, timeout=30)
-        return r.text if r.status_code != 404 else "does not exist"
+def request_get(url, retries=REQUEST_RETRIES):
+    """
+    Args:
+        url (str): URL to query
+        retries (int): How many times to retry transient errors (timeouts are not retried, they already took long enough)
+
+    Returns:
+        (str | None): Response contents, None if index could not be reached
+    """
+    attempt = 0
+    while True:
+        try:
+            r = requests.get(url, timeout=30)
+            if r.status_code < 500:
+                return r.text if r.status_code != 404 else "does not exist"
+
+            LOG.debug("GET %s returned %s", url, r.status_code)
+
+        except requests.Timeout:
+            return None
+
+        except IOError as e:
+            LOG.debug("GET %s failed: %s", url, e)
+
+        if attempt >= retries:
+            return None
+
+        time.sleep(REQUEST_BACKOFF * (2 ** attempt) * random.uniform(0.5, 1.5))  # nosec, jitter is not used for security
+        attempt += 1
+
+
+class IndexCircuitBreaker(object):
+    """Persisted count of consecutive failed lookups for an index, allows to not query an index that is down for a while"""
+
+    def __init__(self, cache, index):
+        """
+        Args:
+            cache (str): Folder where to persist breaker state
+            index (str): Pypi index being tracked
+        """
+        self.index = index
+        key = hashlib.sha1(index.encode("utf-8")).hexdigest()[:12]  # nosec, not used for security
+        self.path = os.path.join(cache, "index-%s.breaker" % key)
+        data = runez.read_json(self.path, default={})
+        self.failures = data.get("failures", 0)
+        self.opened_until = data.get("opened_until", 0)
+
+    def __repr__(self):
+        return "%s failures for %s" % (self.failures, self.index)
 
-    except IOError:
-        return None
+    @property
+    def is_open(self):
+        """bool: True if index is considered down, and should not be queried for now"""
+        return self.opened_until > time.time()
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= BREAKER_THRESHOLD:
+            self.opened_until = time.time() + BREAKER_COOLDOWN
+            cooldown = runez.represented_duration(BREAKER_COOLDOWN)
+            LOG.warning("Index %s failed %s times in a row, not querying it for %s", self.index, self.failures, cooldown)
+
+        data = dict(index=self.index, failures=self.failures, opened_until=self.opened_until)
+        runez.save_json(data, self.path, fatal=False, logger=None)
+
+    def record_success(self):
+        if self.failures:
+            self.failures = 0
+            self.opened_until = 0
+            runez.delete(self.path, fatal=False, logger=None)
+
+
+class IndexStats(object):
+    """Rolling latency and error rate of pypi index mirrors, persisted in cache, allows to pick fastest healthy mirror"""
+
+    def __init__(self, cache):
+        """
+        Args:
+            cache (str | None): Folder where to persist stats (not persisted if None)
+        """
+        self.path = cache and os.path.join(cache, "index-stats.json")
+        self.stats = runez.read_json(self.path, default={}) if self.path else {}
+
+    def __repr__(self):
+        return "%s indexes" % len(self.stats)
+
+    def latency(self, index):
+        """float: Rolling lookup latency of 'index' in seconds (0 if never used, so that new mirrors get tried)"""
+        return self.stats.get(index, {}).get("latency", 0)
+
+    def error_rate(self, index):
+        """float: Rolling error rate of 'index', between 0 and 1"""
+        return self.stats.get(index, {}).get("errors", 0)
+
+    def ranked(self, indexes):
+        """
+        Args:
+            indexes (list): Index mirrors, in configured order of preference
+
+        Returns:
+            (list): Same indexes, healthy ones first, fastest first (configured order is kept for ties)
+        """
+        return sorted(indexes, key=lambda i: (self.error_rate(i) >= STATS_UNHEALTHY, self.latency(i)))
+
+    def record(self, index, elapsed, failed):
+        """
+        Args:
+            index (str): Index that was queried
+            elapsed (float): Time in seconds the query took
+            failed (bool): True if index could not be reached
+        """
+        if self.path:
+            self.stats = runez.read_json(self.path, default={})  # Pick up what other pickley processes recorded meanwhile
+
+        current = self.stats.get(index)
+        if current is None:
+            current = dict(latency=elapsed, errors=1.0 if failed else 0.0)
+
+        else:
+            current["latency"] = STATS_WEIGHT * elapsed + (1 - STATS_WEIGHT) * current.get("latency", elapsed)
+            current["errors"] = STATS_WEIGHT * (1 if failed else 0) + (1 - STATS_WEIGHT) * current.get("errors", 0)
+
+        current["latency"] = round(current["latency"], 4)
+        current["errors"] = round(current["errors"], 4)
+        self.stats[index] = current
+        if self.path:
+            tmp = "%s.%s.tmp" % (self.path, os.getpid())
+            runez.save_json(self.stats, tmp, fatal=False, logger=None)
+            if os.path.exists(tmp):
+                os.rename(tmp, self.path)
 
 
 class PypiInfo(object):
@@ -85,6 +220,8 @@ class PypiInfo(object):
         self.index = index or pspec.cfg.default_index
         self.pspec = pspec
         self.problem = None
+        self.breaker = None  # type: IndexCircuitBreaker
+        self.unreachable = False  # True if index could not be queried (another mirror should be tried)
         if "{name}" in self.index:
             self.url = self.index.format(name=self.pspec.dashed)
 
@@ -92,9 +229,34 @@ class PypiInfo(object):
             # Assume legacy only for now for custom pypi indices
             self.url = "%s/" % os.path.join(self.index, self.pspec.dashed)
 
+        if os.path.isdir(self.index):  # Local wheelhouse
+            self.url = self.index
+            self._set_latest(os.listdir(self.index), include_prereleases)
+            return
+
+        if pspec.cfg.cache:
+            self.breaker = IndexCircuitBreaker(pspec.cfg.cache.path, self.index)
+            if self.breaker.is_open:
+                until = time.strftime("%H:%M:%S", time.localtime(self.breaker.opened_until))
+                self.problem = "index %s is down, not querying it until %s" % (self.index, until)
+                self.unreachable = True
+                return
+
+        started = time.time()
         data = request_get(self.url)
+        elapsed = time.time() - started
+        pspec.cfg.index_stats().record(self.index, elapsed, failed=not data)
+        METRICS.index_lookup(self.index, elapsed, failed=not data)
+        if self.breaker:
+            if data:
+                self.breaker.record_success()
+
+            else:
+                self.breaker.record_failure()
+
         if not data:
             self.problem = "no data for %s, check your connection" % self.url
+            self.unreachable = True
             return
 
         if data[0] == "{":  # See https://warehouse.pypa.io/api-reference/json/
@@ -114,18 +276,34 @@ class PypiInfo(object):
             self.problem = "does not exist on %s" % self.index
             return
 
-        releases = set()
-        prereleases = set()
+        filenames = []
         for line in lines:
             m = RE_BASENAME.search(line)
             if m:
-                version = PepVersion(self.version_part(m.group(1)))
-                if version.components:
-                    if version.prerelease:
-                        prereleases.add(version)
+                filenames.append(m.group(1))
+
+        self._set_latest(filenames, include_prereleases)
+
+    def __repr__(self):
+        return "%s %s" % (self.pspec, self.latest)
+
+    def _set_latest(self, filenames, include_prereleases):
+        """
+        Args:
+            filenames (list): Names of published files (wheels or source distributions)
+            include_prereleases (bool): If True, include latest pre-release
+        """
+        releases = set()
+        prereleases = set()
+        for filename in filenames:
+            version = self.version_part(filename)
+            version = version and PepVersion(version)
+            if version and version.components:
+                if version.prerelease:
+                    prereleases.add(version)
 
-                    else:
-                        releases.add(version)
+                else:
+                    releases.add(version)
 
         if include_prereleases or not releases:
             releases = releases | prereleases
@@ -137,9 +315,6 @@ class PypiInfo(object):
 
         self.problem = "no versions published on %s" % self.index
 
-    def __repr__(self):
-        return "%s %s" % (self.pspec, self.latest)
-
     def _version_part(self, filename):
         if filename:
             filename = filename.lower()
@@ -3,6 +3,29 @@ import os
 import runez
 
 
+V1_FILES = (".current.json", ".entry-points.json", ".latest.json", ".ping")
+
+
+def scanned_folder(folder):
+    """
+    Args:
+        folder (str): Folder to scan
+
+    Returns:
+        (list): (name, full path, is_dir) for each entry in 'folder', obtained with a single directory scan
+    """
+    scandir = getattr(os, "scandir", None)
+    if scandir is None:  # pragma: no cover, python2
+        result = []
+        for fname in os.listdir(folder):
+            fpath = os.path.join(folder, fname)
+            result.append((fname, fpath, os.path.isdir(fpath)))
+
+        return result
+
+    return [(entry.name, entry.path, entry.is_dir()) for entry in scandir(folder)]
+
+
 class V1Install(object):
     """Name and entry points of an older v1 install"""
 
@@ -20,35 +43,49 @@ class V1Status(object):
     def __init__(self, cfg):
         self.cfg = cfg
         self.installed = []
-        if not os.path.isdir(cfg.meta.path):
+        self.leftovers = []  # Folders (or files) with v1 remnants that can be cleaned up
+        self.migrated = os.path.exists(self.marker_path)
+        if self.migrated or not os.path.isdir(cfg.meta.path):
             return
 
-        for fname in os.listdir(cfg.meta.path):
-            if fname == "pickley":
+        for fname, fpath, is_dir in scanned_folder(cfg.meta.path):
+            if fname == "_venvs":
+                self.leftovers.append(fpath)
+                continue
+
+            if not is_dir or fname.startswith("."):
                 continue
 
-            old_manifest = cfg.meta.full_path(fname, ".current.json")
-            old_entrypoints = cfg.meta.full_path(fname, ".entry-points.json")
-            eps = runez.read_json(old_entrypoints, default=None)
-            if eps and os.path.exists(old_manifest):
-                v1 = V1Install(fname, eps)
-                self.installed.append(v1)
+            remnants = [name for name in V1_FILES if os.path.exists(os.path.join(fpath, name))]
+            if remnants:
+                self.leftovers.append(fpath)
+                if fname != "pickley" and ".current.json" in remnants and ".entry-points.json" in remnants:
+                    eps = runez.read_json(os.path.join(fpath, ".entry-points.json"), default=None)
+                    if eps:
+                        self.installed.append(V1Install(fname, eps))
+
+    @property
+    def marker_path(self):
+        """str: Marker file stating that there is nothing left to migrate from v1 (scan is then skipped)"""
+        return self.cfg.meta.full_path(".v1-migrated")
 
     def clean_old_files(self):
-        for fname in os.listdir(self.cfg.meta.path):
-            fpath = os.path.join(self.cfg.meta.path, fname)
-            if fname == "_venvs":
+        """Delete v1 remnants found by initial scan"""
+        for fpath in self.leftovers:
+            if os.path.basename(fpath) == "_venvs":
                 runez.delete(fpath)
                 continue
 
-            if not os.path.isdir(fpath):
-                continue
-
-            runez.delete(os.path.join(fpath, ".current.json"))
-            runez.delete(os.path.join(fpath, ".entry-points.json"))
-            runez.delete(os.path.join(fpath, ".latest.json"))
-            runez.delete(os.path.join(fpath, ".ping"))
+            for name in V1_FILES:
+                runez.delete(os.path.join(fpath, name))
 
-            remaining = os.listdir(fpath)
-            if fname != "pickley" and not remaining:
+            if os.path.basename(fpath) != "pickley" and not os.listdir(fpath):
                 runez.delete(fpath)
+
+        self.leftovers = []
+
+    def mark_migrated(self):
+        """Remember that migration is complete, so that subsequent runs don't rescan .pickley/"""
+        if not self.migrated and os.path.isdir(self.cfg.meta.path):
+            runez.touch(self.marker_path, logger=None)
+            self.migrated = True
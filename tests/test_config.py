@@ -4,9 +4,10 @@ import runez
 from mock import MagicMock, patch
 from runez.conftest import resource_path
 
-from pickley import __version__, despecced, get_default_index, inform, PackageSpec
-from pickley import PickleyConfig, pypi_name_problem, specced, TrackedSettings
-from pickley.cli import auto_upgrade_v1
+from pickley import __version__, acquire_fetch_lock, despecced, failed_lookup_ttl, get_default_index, inform, PackageSpec
+from pickley import PickleyConfig, pypi_name_problem, rollout_delay, specced, TrackedSettings
+from pickley.cli import auto_upgrade_v1, rollout_wait
+from pickley.package import PythonVenv
 from pickley.v1upgrade import V1Status
 
 
@@ -43,6 +44,7 @@ cli:  # empty
 defaults:
   delivery: wrap
   install_timeout: 30
+  max_concurrent_upgrades: 2
   version_check_delay: 5
 """
 
@@ -127,6 +129,56 @@ def test_desired_version(temp_folder):
         assert p.cfg.install_timeout(p) == 42  # From tox specific pin in samples/.../config.json
 
 
+def test_precompile(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    mgit = PackageSpec(cfg, "mgit")
+    assert cfg.precompile(mgit) is None
+
+    cfg.set_base(".", flags=dict(precompile=True))
+    assert cfg.precompile(mgit) == 0
+
+    cfg.set_base(".", flags=dict(precompile=True, pinned={"mgit": {"precompile": "4"}}))
+    assert cfg.precompile(mgit) == 4
+    assert cfg.precompile(PackageSpec(cfg, "tox")) == 0
+
+
+def test_max_concurrent_upgrades(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    assert cfg.max_concurrent_upgrades() == 2
+
+    cfg.set_base(".", flags=dict(max_concurrent_upgrades="0"))
+    assert cfg.max_concurrent_upgrades() == 0  # 0 (no cap) is not overridden by default
+
+    runez.save_json({"max_concurrent_upgrades": 0}, ".pickley/config.json")
+    cfg.set_base(".")
+    assert cfg.max_concurrent_upgrades() == 0
+
+    cfg.set_base(".", flags=dict(max_concurrent_upgrades=3))
+    assert cfg.max_concurrent_upgrades() == 3
+
+
+def test_wheelhouse(temp_folder):
+    runez.touch("wheels/mgit-1.2.0-py3-none-any.whl")
+    cfg = PickleyConfig()
+    cfg.set_base(".", flags=dict(wheelhouse="wheels"))
+    assert cfg.configs[0].source == "cli"
+    wheelhouse = runez.resolved_path("wheels")
+    mgit = PackageSpec(cfg, "mgit")
+    assert cfg.wheelhouse(mgit) == wheelhouse
+    d = mgit.get_desired_version_info()
+    assert d.index == wheelhouse
+    assert d.source == "latest"
+    assert d.version == "1.2.0"
+    assert not os.path.exists(".pickley/.cache/mgit.latest")  # Local lookups are not cached
+
+    venv = PythonVenv("", mgit.python, mgit.index, wheelhouse=cfg.wheelhouse(mgit))
+    assert venv.index_args() == ["--no-index", "--find-links", wheelhouse]
+    venv = PythonVenv("", mgit.python, "https://example.com/pypi")
+    assert venv.index_args() == ["-i", "https://example.com/pypi"]
+
+
 def test_speccing():
     assert specced("mgit", "1.0.0") == "mgit==1.0.0"
     assert specced(" mgit ", " 1.0.0 ") == "mgit==1.0.0"
@@ -182,3 +234,182 @@ def test_v1(temp_folder, logged):
         assert not os.path.exists(".pickley/_venvs")  # cleaned
         assert not os.path.exists(".pickley/foo")
         assert not os.path.exists(".pickley/pickley2-a")
+        assert os.path.exists(".pickley/.v1-migrated")
+
+    # Once migrated, .pickley/ is not scanned anymore
+    runez.touch(".pickley/bar/.ping")
+    with patch("os.listdir", side_effect=Exception) as listdir:
+        with patch("os.scandir", side_effect=Exception) as scandir:
+            auto_upgrade_v1(cfg)
+            assert not listdir.call_count
+            assert not scandir.call_count
+
+    assert os.path.exists(".pickley/bar/.ping")
+
+
+def test_v1_never_installed(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    auto_upgrade_v1(cfg)
+    assert not os.path.exists(".pickley")  # No .pickley/ folder yet: nothing scanned, nothing to remember
+
+    runez.touch(".pickley/mgit/.manifest.json")
+    runez.touch(".pickley/tox/.ping")  # v1 leftover, without a v1 install
+    auto_upgrade_v1(cfg)
+    assert os.path.exists(".pickley/.v1-migrated")
+    assert os.path.exists(".pickley/mgit/.manifest.json")
+    assert not os.path.exists(".pickley/tox")
+
+
+def test_failed_lookups(temp_folder):
+    assert failed_lookup_ttl(1) == 60
+    assert failed_lookup_ttl(3) == 240
+    assert failed_lookup_ttl(20) == 3600
+
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    p = PackageSpec(cfg, "foo")
+    with patch("pickley.PypiInfo", return_value=MagicMock(problem="does not exist", latest=None, breaker=None)) as lookup:
+        assert p.get_desired_version_info().problem == "does not exist"
+        assert runez.read_json(".pickley/.cache/foo.failed")["failures"] == 1
+        assert not os.path.exists(".pickley/.cache/foo.latest")
+
+        # Failure is remembered for a while...
+        assert p.get_desired_version_info().problem == "does not exist"
+        assert lookup.call_count == 1
+
+        # ... unless forced
+        p.get_desired_version_info(force=True)
+        assert lookup.call_count == 2
+        assert runez.read_json(".pickley/.cache/foo.failed")["failures"] == 2
+
+        # ... or TTL (which grows with consecutive failures) expired
+        with patch("runez.file.is_younger", return_value=False):
+            p.get_desired_version_info()
+            assert lookup.call_count == 3
+            assert runez.read_json(".pickley/.cache/foo.failed")["failures"] == 3
+
+    with patch("pickley.PypiInfo", return_value=MagicMock(problem=None, latest="1.0")):
+        assert p.get_desired_version_info(force=True).version == "1.0"
+        assert not os.path.exists(".pickley/.cache/foo.failed")
+        assert os.path.exists(".pickley/.cache/foo.latest")
+
+    # Failed lookups (and their negative cache) fall back to last successful lookup, if any
+    os.utime(".pickley/.cache/foo.latest", (0, 0))
+    with patch("pickley.PypiInfo", return_value=MagicMock(problem="index is down", latest=None, breaker=None)) as lookup:
+        assert p.get_desired_version_info().problem == "index is down"
+        assert lookup.call_count == 1
+        desired = p.get_desired_version_info()
+        assert lookup.call_count == 1  # Negative cache hit
+        assert desired.version == "1.0"
+        assert not desired.problem
+
+
+def test_config_snapshot(temp_folder):
+    runez.save_json({"include": "custom.json", "index": "https://example.com/pypi"}, ".pickley/config.json")
+    runez.save_json({"install_timeout": 3}, ".pickley/custom.json")
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    assert not os.path.exists(".pickley/.cache/config.snapshot.json")  # Cache folder is not created just for snapshot
+
+    runez.ensure_folder(".pickley/.cache")
+    cfg.set_base(".")
+    assert os.path.exists(".pickley/.cache/config.snapshot.json")
+    expected = cfg.represented()
+
+    read = []
+
+    def tracked_read_json(path, **kwargs):
+        read.append(os.path.basename(path))
+        return runez.serialize.read_json(path, **kwargs)
+
+    with patch("runez.read_json", side_effect=tracked_read_json):
+        cfg = PickleyConfig()
+        cfg.set_base(".")
+        assert read == ["config.snapshot.json"]  # Warm: source files are not parsed
+        assert cfg.represented() == expected
+        assert cfg.install_timeout() == 3
+
+        # Modifying an included file invalidates snapshot
+        del read[:]
+        runez.save_json({"install_timeout": 4}, ".pickley/custom.json")
+        mtime = os.path.getmtime(".pickley/custom.json") + 10
+        os.utime(".pickley/custom.json", (mtime, mtime))
+        cfg.set_base(".")
+        assert read == ["config.snapshot.json", "config.json", "custom.json"]
+        assert cfg.install_timeout() == 4
+
+        # Creating a previously missing file does too
+        del read[:]
+        cfg.set_base(".", config_path="extra.json")
+        assert "extra.json" in read
+        del read[:]
+        cfg.set_base(".", config_path="extra.json")
+        assert read == ["config.snapshot.json"]
+        runez.save_json({"install_timeout": 5}, "extra.json")
+        cfg.set_base(".", config_path="extra.json")
+        assert cfg.install_timeout() == 5
+
+
+def test_rollout(temp_folder):
+    # Delay is deterministic per host and package, and spread over the window
+    assert rollout_delay("host1", "mgit", 3600) == rollout_delay("host1", "mgit", 3600)
+    delays = [rollout_delay("host%s" % i, "mgit", 3600) for i in range(200)]
+    assert min(delays) < 600 and max(delays) > 3000
+    assert rollout_delay("host1", "mgit", 3600, canary=100) == 0
+    delays = [rollout_delay("host%s" % i, "mgit", 3600, canary=50) for i in range(200)]
+    assert 60 < delays.count(0) < 140
+
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    p = PackageSpec(cfg, "mgit")
+    with patch("pickley.PypiInfo", return_value=MagicMock(problem=None, latest="1.0")):
+        desired = p.get_desired_version_info()
+        assert desired.first_seen
+        assert p.rollout_eligible_at(desired) is None  # No rollout policy by default
+
+        # First sighting of a version is remembered across lookups
+        runez.save_json(dict(runez.read_json(".pickley/.cache/mgit.latest"), first_seen=1000), ".pickley/.cache/mgit.latest")
+        assert p.get_desired_version_info(force=True).first_seen == 1000
+
+    with patch("pickley.PypiInfo", return_value=MagicMock(problem=None, latest="1.1")):
+        desired = p.get_desired_version_info(force=True)
+        assert desired.first_seen > 1000  # New version
+
+    cfg.set_base(".", flags=dict(rollout_window=60))
+    with patch("socket.gethostname", return_value="host1"):
+        delay = rollout_delay("host1", "mgit", 3600)
+        assert p.rollout_eligible_at(desired) == desired.first_seen + delay
+        assert rollout_wait(p, desired) > 0
+        explicit = PackageSpec(cfg, "mgit==1.0")
+        assert explicit.rollout_eligible_at(explicit.get_desired_version_info()) is None  # Explicit versions are not staggered
+
+    cfg.set_base(".", flags=dict(rollout_window=60, rollout_canary=100))
+    assert rollout_wait(p, desired) == 0
+
+
+def test_coalesced_lookups(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    p = PackageSpec(cfg, "mgit")
+    lock = ".pickley/.cache/mgit.fetching"
+    assert acquire_fetch_lock(lock)  # Creates cache folder if needed
+    assert not acquire_fetch_lock(lock)  # Held by a live process (us)
+
+    def other_process_done(_):
+        # Simulate the other process completing its lookup while we wait
+        runez.save_json({"source": "latest", "version": "1.5"}, ".pickley/.cache/mgit.latest")
+        runez.delete(lock)
+
+    with patch("pickley.PypiInfo") as lookup:
+        with patch("time.sleep", side_effect=other_process_done):
+            assert p.get_desired_version_info(force=True).version == "1.5"
+            assert not lookup.called
+
+    # Stale locks (dead process) are taken over, lock is released after lookup
+    runez.write(lock, "0\n")
+    with patch("pickley.PypiInfo", return_value=MagicMock(problem=None, latest="2.0")) as lookup:
+        assert p.get_desired_version_info(force=True).version == "2.0"
+        assert lookup.call_count == 1
+        assert not os.path.exists(lock)
+        assert not [f for f in os.listdir(".pickley/.cache") if f.endswith(".tmp")]  # Written atomically via temp file
@@ -5,7 +5,7 @@ import runez
 from mock import MagicMock, patch
 
 from pickley import PackageSpec, PickleyConfig
-from pickley.delivery import DeliveryMethod, ensure_safe_to_replace
+from pickley.delivery import DeliveryMethod, DeliveryMethodWrap, ensure_safe_to_replace, wrapper_without_auto_upgrade
 
 
 BREW_INSTALL = "/brew/install/bin"
@@ -102,3 +102,20 @@ def test_uninstall_brew(temp_folder, brew, logged):
     with pytest.raises(SystemExit):
         ensure_safe_to_replace(brew, "%s/wget" % BREW_INSTALL)
     assert "Can't automatically uninstall" in logged.pop()
+
+
+def test_wrapper_without_auto_upgrade(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    runez.write("foo", "#!/bin/sh\necho foo")
+    assert wrapper_without_auto_upgrade("foo") is None  # Not a pickley wrapper
+
+    for name in ("mgit", "pickley"):
+        pspec = PackageSpec(cfg, name)
+        DeliveryMethodWrap()._install(pspec, name, "/dev/null/%s" % name)
+        assert "auto-upgrade %s" % name in "\n".join(runez.readlines(name))
+        contents = wrapper_without_auto_upgrade(name)
+        assert "nohup" not in contents
+        assert any(line.strip() == ":" for line in contents.splitlines())  # Spawn replaced with a no-op
+        runez.write("bare", contents)
+        assert runez.run("bash", "-n", "bare", fatal=False).succeeded  # Still valid bash
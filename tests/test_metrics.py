@@ -0,0 +1,124 @@
+import os
+import time
+
+import runez
+from mock import patch
+
+from pickley import PickleyConfig
+from pickley.metrics import escaped_label, export_metrics, METRICS, MetricsCollector, rendered_textfile
+
+
+def test_collector():
+    m = MetricsCollector()
+    m.cache_lookup("latest", hit=True)
+    m.cache_lookup("latest", hit=False)
+    m.cache_lookup("latest", hit=True)
+    m.index_lookup("https://a", 0.5, failed=False)
+    m.index_lookup("https://a", 1.5, failed=True)
+    m.installed("mgit", dict(pip=2.0, total=3.0))
+    m.lock_wait(0.25)
+    assert str(m) == "7 events"
+
+    state = m.merged_state({"cache": {"latest": {"hits": 10, "misses": 0}}, "lock": {"waits": 1, "seconds": 1, "last": 1}})
+    assert state["cache"]["latest"] == {"hits": 12, "misses": 1}
+    assert state["indexes"]["https://a"] == {"lookups": 2, "errors": 1, "seconds": 2.0}
+    assert state["installs"]["mgit"] == {"pip": 2.0, "total": 3.0}
+    assert state["lock"] == {"waits": 2, "seconds": 1.25, "last": 0.25}
+
+    m.reset()
+    assert str(m) == "0 events"
+
+    assert escaped_label('a"b\\c\nd') == 'a\\"b\\\\c\\nd'
+
+
+def test_textfile(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    now = time.time()
+    runez.save_json({"version": "1.0"}, ".pickley/mgit/.manifest.json")
+    runez.save_json({"version": "2.0"}, ".pickley/tox/.manifest.json")
+    runez.save_json({"first_seen": int(now) - 100, "source": "latest", "version": "1.1"}, ".pickley/.cache/mgit.latest")
+    runez.save_json({"first_seen": int(now) - 100, "source": "latest", "version": "2.0"}, ".pickley/.cache/tox.latest")
+    state = {
+        "cache": {"latest": {"hits": 3, "misses": 1}},
+        "indexes": {"https://a": {"lookups": 2, "errors": 1, "seconds": 2.0}},
+        "installs": {"mgit": {"pip": 2.0}},
+        "lock": {"waits": 2, "seconds": 1.25, "last": 0.25},
+    }
+    text = rendered_textfile(cfg, state, now=now).splitlines()
+    assert "# TYPE pickley_package_info gauge" in text
+    assert 'pickley_package_info{package="mgit",version="1.0"} 1' in text
+    assert 'pickley_package_outdated{package="mgit"} 1' in text
+    assert 'pickley_package_outdated{package="tox"} 0' in text
+    assert 'pickley_package_lag_seconds{package="mgit"} 100' in text
+    assert 'pickley_package_lag_seconds{package="tox"} 0' in text
+    assert 'pickley_index_lookup_errors_total{index="https://a"} 1' in text
+    assert 'pickley_install_phase_seconds{package="mgit",phase="pip"} 2.0' in text
+    assert 'pickley_cache_hit_ratio{cache="latest"} 0.75' in text
+    assert "pickley_lock_wait_seconds_total 1.25" in text
+    assert "pickley_metrics_timestamp_seconds %s" % int(now) in text
+
+
+def test_export(cli):
+    METRICS.reset()  # Forget metrics recorded by other tests
+    cli.run("check")
+    assert not os.path.exists("metrics/pickley.prom")  # Not configured
+
+    runez.save_json({"metrics_textfile": "metrics/pickley.prom"}, ".pickley/config.json")
+    runez.save_json({"version": "1.0"}, ".pickley/mgit/.manifest.json")
+    runez.save_json({"source": "latest", "version": "1.0"}, ".pickley/.cache/mgit.latest")
+    cli.expect_success("check mgit", "mgit: v1.0 is installed")
+    text = runez.readlines("metrics/pickley.prom")
+    assert 'pickley_package_info{package="mgit",version="1.0"} 1' in text
+    assert 'pickley_cache_hits_total{cache="latest"} 1' in text
+    assert not [f for f in os.listdir("metrics") if f != "pickley.prom"]  # Written atomically
+
+    # Counters accumulate across runs
+    cli.expect_success("check mgit", "mgit: v1.0 is installed")
+    assert 'pickley_cache_hits_total{cache="latest"} 2' in runez.readlines("metrics/pickley.prom")
+
+    # Auto-upgrade exports only when it actually checked for a new version
+    runez.delete("metrics/pickley.prom")
+    runez.touch(".pickley/.cache/mgit.ping")
+    cli.expect_success("--debug auto-upgrade mgit", "Skipping auto-upgrade, checked recently")
+    assert not os.path.exists("metrics/pickley.prom")
+
+
+def test_dryrun(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".", flags=dict(metrics_textfile="pickley.prom"))
+    with patch("runez.DRYRUN", True):
+        assert export_metrics(cfg) is None
+
+    METRICS.reset()
+    METRICS.lock_wait(1)
+    assert export_metrics(cfg) == os.path.abspath("pickley.prom")
+    assert "pickley_lock_waits_total 1" in runez.readlines("pickley.prom")
+    assert str(METRICS) == "0 events"
+
+
+def test_export_lock(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".", flags=dict(metrics_textfile="pickley.prom"))
+    METRICS.reset()
+    METRICS.lock_wait(1)
+
+    # State is not touched while another process is exporting
+    runez.write(".pickley/.cache/metrics.json.lock", "%s\n" % os.getpid())
+    with patch("pickley.metrics.METRICS_LOCK_WAIT", 0):
+        assert export_metrics(cfg) is None
+    assert not os.path.exists("pickley.prom")
+    assert not os.path.exists(".pickley/.cache/metrics.json")
+    assert str(METRICS) == "1 events"
+
+    # State is persisted only once textfile is written
+    runez.delete(".pickley/.cache/metrics.json.lock")
+    with patch("runez.write"):
+        assert export_metrics(cfg) is None
+    assert not os.path.exists(".pickley/.cache/metrics.json")
+    assert not os.path.exists(".pickley/.cache/metrics.json.lock")
+
+    assert export_metrics(cfg) == os.path.abspath("pickley.prom")
+    assert runez.read_json(".pickley/.cache/metrics.json")["lock"]["waits"] == 1
+    assert not os.path.exists(".pickley/.cache/metrics.json.lock")
+    assert str(METRICS) == "0 events"
@@ -1,14 +1,20 @@
+import base64
+import hashlib
+import json
 import os
+import subprocess
 import sys
+import time
 
 import pytest
 import runez
-from mock import patch
+from mock import MagicMock, patch
 from runez.conftest import project_folder
 
-from pickley.cli import find_base, PackageFinalizer, protected_main, SoftLock, SoftLockException
-from pickley.delivery import WRAPPER_MARK
-from pickley.package import Packager
+from pickley import CFG, PackageSpec, PickleyConfig, rollout_delay
+from pickley.cli import find_base, PackageFinalizer, PipelinedUpgrade, protected_main, SoftLock, SoftLockException, UpgradeSlots
+from pickley.delivery import DeliveryMethodWrap, WRAPPER_MARK
+from pickley.package import Packager, run_with_timeout
 
 
 def test_base(temp_folder):
@@ -69,6 +75,51 @@ def test_debian_mode(temp_folder, logged):
     assert p.root == "root"
 
 
+def test_sanity_check(temp_folder):
+    runez.write("fast", "#!/bin/bash\necho fast $1\n")
+    runez.write("slow", "#!/bin/bash\nsleep 30\n")
+    runez.make_executable("fast")
+    runez.make_executable("slow")
+
+    r = run_with_timeout(5, "./fast", "--version", fatal=False)
+    assert r.succeeded
+    assert not r.timed_out
+    assert r.output == "fast --version"
+
+    r = run_with_timeout(0.5, "./slow", fatal=False)
+    assert r.failed
+    assert r.timed_out
+    assert "timed out" in r.error
+
+    with pytest.raises(runez.system.AbortException):
+        run_with_timeout(0.5, "./slow")
+
+    # Child runs in its own session, it gets killed if pickley itself is interrupted
+    runez.write("orphan", "#!/bin/bash\necho $$ > orphan.pid\nsleep 30\n")
+    runez.make_executable("orphan")
+
+    def interrupted_communicate(p, *args, **kwargs):
+        for _ in range(50):
+            if os.path.exists("orphan.pid"):
+                break
+
+            time.sleep(0.05)
+
+        raise KeyboardInterrupt
+
+    with patch.object(subprocess.Popen, "communicate", interrupted_communicate):
+        with pytest.raises(KeyboardInterrupt):
+            run_with_timeout(5, "./orphan")
+
+    pid = runez.to_int(runez.readlines("orphan.pid")[0])
+    assert pid and not runez.check_pid(pid)
+
+    p = PackageFinalizer(".", "build", "dist", None, "--version", None, sanity_check_timeout=0.5)
+    results = {runez.basename(exe): r for exe, r, _ in p.sanity_checked(["./fast", "./slow"])}
+    assert results["fast"].output == "fast --version"
+    assert results["slow"].timed_out
+
+
 def test_dryrun(cli):
     cli.expect_success("--help", "Usage:")
 
@@ -156,6 +207,57 @@ def test_edge_cases(temp_folder, logged):
         Packager.package(None, None, None, None)
 
 
+def test_pipelined_upgrade(temp_folder, logged):
+    CFG.set_base(".")
+    installed = []
+
+    def mock_build_wheels(pspec, folder):
+        return runez.program.RunResult(code=1 if pspec.dashed == "tox" else 0)
+
+    def mock_install(pspec, **_):
+        installed.append((pspec.dashed, pspec.version, pspec.prefetched))
+
+    for name, version in (("mgit", "1.0"), ("pipenv", "2.0"), ("tox", "1.0")):
+        runez.save_json({"version": version}, ".pickley/%s/.manifest.json" % name)
+
+    with patch("pickley.PypiInfo", return_value=MagicMock(problem=None, latest="2.0")):
+        with patch("pickley.cli.build_wheels", side_effect=mock_build_wheels):
+            with patch("pickley.cli.perform_install", side_effect=mock_install):
+                packages = [PackageSpec(CFG, name) for name in ("mgit", "pipenv", "tox")]
+                PipelinedUpgrade(packages, depth=1).run()
+
+    wheels = CFG.cache.full_path("wheels-%s" % os.getpid())
+    assert installed == [("mgit", "2.0", wheels), ("pipenv", None, None), ("tox", "2.0", None)]
+    assert "Pipelined upgrade of 3 packages done" in logged.pop()
+    assert not os.path.exists(wheels)
+
+    # Nothing is prefetched from index when a wheelhouse is configured
+    CFG.set_base(".", flags=dict(wheelhouse="wheelhouse"))
+    runez.touch("wheelhouse/mgit-3.0-py3-none-any.whl")
+    assert PackageSpec(CFG, "mgit").get_desired_version_info().version == "3.0"
+    installed = []
+    with patch("pickley.cli.build_wheels") as build:
+        with patch("pickley.cli.perform_install", side_effect=mock_install):
+            packages = [PackageSpec(CFG, name) for name in ("mgit", "pipenv", "tox")]
+            PipelinedUpgrade(packages, depth=1).run()
+
+    assert not build.called
+    assert installed[0] == ("mgit", None, None)  # Installed from wheelhouse, not from prefetched wheels
+    CFG.set_base(".")
+
+    # A failing producer doesn't leave consumer hanging, its error is raised by consumer
+    installed = []
+    with patch("pickley.PackageSpec.get_desired_version_info", side_effect=[MagicMock(problem=None, version="2.0"), SystemExit(1)]):
+        with patch("pickley.cli.build_wheels", side_effect=mock_build_wheels):
+            with patch("pickley.cli.perform_install", side_effect=mock_install):
+                packages = [PackageSpec(CFG, name) for name in ("mgit", "pipenv", "tox")]
+                with pytest.raises(SystemExit):
+                    PipelinedUpgrade(packages, depth=1).run()
+
+    assert installed == [("mgit", "2.0", wheels)]
+    assert not os.path.exists(wheels)
+
+
 def test_lock(temp_folder):
     with SoftLock("foo", 600, 600) as lock:
         assert str(lock) == "foo"
@@ -179,6 +281,107 @@ def test_lock(temp_folder):
     assert not os.path.exists("foo")  # Lock released
 
 
+def test_upgrade_slots(temp_folder):
+    slots = UpgradeSlots("slots", 2, 600)
+    assert str(slots) == "2 slots in slots"
+    assert slots.acquire()
+    assert runez.readlines("slots/0.lock", first=1) == [str(os.getpid())]  # Slot holds its pid as soon as it exists
+
+    other = UpgradeSlots("slots", 2, 600)
+    assert other.acquire()
+    assert other.acquired == "slots/1.lock"
+    assert not UpgradeSlots("slots", 2, 600).acquire()  # Cap reached
+    assert sorted(os.listdir("slots")) == ["0.lock", "1.lock"]  # No temp files left behind
+    assert UpgradeSlots("slots", 0, 600).acquire()  # No cap
+
+    # Slots held by dead processes are reclaimed
+    other.release()
+    assert not os.path.exists("slots/1.lock")
+    runez.write("slots/1.lock", "0\nbar\n")
+    third = UpgradeSlots("slots", 2, 600)
+    assert third.acquire()
+    assert third.acquired == "slots/1.lock"
+
+    # Slot re-grabbed by another process between staleness check and take over is given back
+    third.release()
+    runez.write("slots/1.lock", "%s\nbar\n" % os.getpid())
+    fourth = UpgradeSlots("slots", 2, 600)
+    with patch("pickley.cli.lock_holder", side_effect=[None, "bar"]):
+        assert not fourth._reclaim("slots/1.lock")
+
+    assert fourth.acquired is None
+    assert sorted(os.listdir("slots")) == ["0.lock", "1.lock"]
+    assert not fourth.acquire()
+    runez.delete("slots/1.lock")
+
+    third.release()
+    slots.release()
+    assert os.listdir("slots") == []
+
+
+def test_deferred_auto_upgrade(cli):
+    for i in range(2):
+        runez.write(".pickley/.upgrade-slots/%s.lock" % i, "%s\nauto-upgrade foo\n" % os.getpid())
+
+    cli.expect_success("--debug auto-upgrade mgit", "Deferring auto-upgrade, 2 other upgrades already in progress")
+    assert not os.path.exists(".pickley/.cache/mgit.ping")  # Next invocation will try again
+
+
+def test_rollout(cli):
+    runez.save_json({"rollout_window": 600}, ".pickley/config.json")
+    runez.save_json({"version": "0.9"}, ".pickley/mgit/.manifest.json")
+    runez.save_json({"first_seen": int(time.time()), "source": "latest", "version": "1.0"}, ".pickley/.cache/mgit.latest")
+    with patch("socket.gethostname", return_value="host1"):
+        assert rollout_delay("host1", "mgit", 600 * 60) > 60
+        cli.run("check mgit")
+        assert "v0.9 installed, can be upgraded to v1.0 (auto-upgrade on this host in " in cli.logged.stdout
+
+        cli.expect_success("--debug auto-upgrade mgit", "Deferring auto-upgrade to v1.0, host eligible in ")
+        assert os.path.exists(".pickley/.cache/mgit.ping")  # Checked again after regular version_check_delay
+
+
+def test_offline(cli):
+    runez.save_json({"version": "1.0"}, ".pickley/mgit/.manifest.json")
+    with patch("pickley.PypiInfo", side_effect=Exception("network used")):
+        cli.expect_failure("--offline check mgit", "mgit: latest version is not cached, can't look it up in offline mode")
+
+        runez.save_json({"source": "latest", "version": "1.1"}, ".pickley/.cache/mgit.latest")
+        os.utime(".pickley/.cache/mgit.latest", (0, 0))  # Stale cache is used as-is
+        cli.run("--offline check mgit")
+        assert "mgit: v1.0 installed, can be upgraded to v1.1" in cli.logged.stdout
+
+        runez.save_json({"offline": True}, ".pickley/config.json")  # Config key has same effect as CLI flag
+        cli.expect_failure("install tox", "Can't install tox: latest version is not cached")
+        cli.expect_failure("upgrade mgit", "Can't install mgit v1.1 in offline mode: no wheel found (no wheelhouse configured)")
+        cli.expect_failure("wheelhouse wheels mgit", "Can't fill wheelhouse wheels in offline mode")
+
+
+def test_bench(cli):
+    cli.expect_failure("bench foo", "foo was not delivered by pickley")
+
+    runez.write(".pickley/foo/foo-1.0/bin/foo", "#!/bin/sh\nexit 0\n")
+    runez.make_executable(".pickley/foo/foo-1.0/bin/foo")
+    os.symlink(".pickley/foo/foo-1.0/bin/foo", "foo")
+    cli.run("bench -r3 foo")
+    assert cli.succeeded
+    assert "foo --help, 3 runs each" in cli.logged.stdout
+    assert "| direct " in cli.logged.stdout
+    assert "| symlink " in cli.logged.stdout
+    assert "wrapper" not in cli.logged.stdout
+    assert "Overhead (p50, compared to running venv executable directly): symlink " in cli.logged.stdout
+
+    runez.delete("foo")
+    pspec = PackageSpec(CFG, "foo")
+    DeliveryMethodWrap()._install(pspec, os.path.abspath("foo"), os.path.abspath(".pickley/foo/foo-1.0/bin/foo"))
+    cli.run("bench -r2 foo --version")
+    assert cli.succeeded
+    assert "foo --version, 2 runs each" in cli.logged.stdout
+    assert "| wrapper without auto-upgrade " in cli.logged.stdout
+    assert "wrapper bash hop " in cli.logged.stdout
+    assert "auto-upgrade spawn " in cli.logged.stdout
+    assert "Non-zero exit code" not in cli.logged.stdout
+
+
 def check_install(cli, delivery, package):
     cli.expect_success("-d%s install %s" % (delivery, package), "Installed %s" % package)
     assert runez.is_executable(package)
@@ -241,3 +444,108 @@ def test_package_venv(cli):
     assert runez.is_executable(expected)
     r = runez.run(expected, "--version")
     assert r.succeeded
+
+
+def test_verify(cli):
+    cli.run("verify")
+    assert cli.succeeded
+    assert cli.match("No packages installed")
+
+    # Empty bundles are reported, no worker pool is started for them
+    cli.run("verify bundle:foo")
+    assert cli.succeeded
+    assert cli.match("No packages to verify (empty bundle?)")
+    cli.expect_failure("wheelhouse wheels bundle:foo", "No packages to fill wheelhouse with: bundle:foo expands to nothing")
+    assert not os.path.exists("wheels")
+
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    pspec = PackageSpec(cfg, "mgit==1.0")
+    venv = pspec.install_path
+    site_packages = os.path.join(venv, "lib/python3.7/site-packages")
+    runez.write(os.path.join(site_packages, "mgit/__init__.py"), "# mgit")
+    digest = "sha256=%s" % base64.urlsafe_b64encode(hashlib.sha256(b"# mgit").digest()).rstrip(b"=").decode("ascii")
+    runez.write(os.path.join(site_packages, "mgit-1.0.dist-info/RECORD"), "mgit/__init__.py,%s,6\n../../../bin/mgit,,\n" % digest)
+    runez.write(os.path.join(venv, "bin/mgit"), "#!/bin/sh\n")
+    runez.make_executable(os.path.join(venv, "bin/mgit"))
+    runez.symlink(sys.executable, os.path.join(venv, "bin/python"))
+    DeliveryMethodWrap()._install(pspec, "mgit", os.path.abspath(os.path.join(venv, "bin/mgit")))
+    pspec.save_manifest({"mgit": "mgit.cli:main"})
+    runez.save_json({"version": "1.0"}, ".pickley/tox/.manifest.json")
+
+    cli.run("verify mgit")
+    assert cli.succeeded
+    assert "| mgit    | 1.0     | OK " in cli.logged.stdout.contents()
+
+    cli.run("verify --json")
+    assert cli.failed
+    report = json.loads(cli.logged.stdout.contents())
+    assert report == {
+        "mgit": {"problems": [], "version": "1.0"},
+        "tox": {"problems": ["venv .pickley/tox/tox-1.0 does not exist"], "version": "1.0"},
+    }
+
+    runez.write(os.path.join(site_packages, "mgit/__init__.py"), "# modified")
+    runez.delete(os.path.join(venv, "bin/mgit"))
+    runez.delete(os.path.join(venv, "bin/python"))
+    cli.run("verify --sample 100 mgit")
+    assert cli.failed
+    output = cli.logged.stdout.contents()
+    assert "python .pickley/mgit/mgit-1.0/bin/python does not exist" in output
+    assert "entry point mgit points to missing .pickley/mgit/mgit-1.0/bin/mgit" in output
+    assert "missing ../../../bin/mgit" in output
+    assert "modified mgit/__init__.py" in output
+    assert "1 package with problems" in output
+
+
+def test_bulk_commands_are_lazy(cli):
+    for i in range(20):
+        runez.save_json({"version": "1.0", "entrypoints": ["p%s" % i]}, ".pickley/p%s/.manifest.json" % i, logger=None)
+
+    with patch("pickley.env.AvailablePythons.find_python", side_effect=Exception("no interpreter discovery expected")):
+        cli.run("list")
+        assert cli.succeeded
+        assert "| p19     | 1.0     |" in cli.logged.stdout.contents()
+
+        cli.run("uninstall p3 p4")
+        assert cli.succeeded
+        assert not os.path.exists(".pickley/p3")
+
+
+def test_trash(cli):
+    runez.save_json({"version": "1.0", "entrypoints": ["mgit"]}, ".pickley/mgit/.manifest.json")
+    runez.touch(".pickley/mgit/mgit-1.0/bin/mgit")
+    runez.touch("mgit")
+    with patch("pickley.cli.delete_in_background", return_value=os.getpid()) as reaper:
+        cli.run("uninstall mgit")
+        assert cli.succeeded
+        assert not os.path.exists("mgit")
+        assert not os.path.exists(".pickley/mgit")
+        trashed = os.listdir(".pickley/.trash")
+        assert len(trashed) == 2
+        assert trashed[0].startswith("mgit-") or trashed[1].startswith("mgit-")
+        assert reaper.call_count == 1
+        assert runez.readlines(".pickley/.trash/.reaper") == [str(os.getpid())]
+
+        # Reaper (simulated by this very process) is still running: later runs don't start another one
+        cli.run("list")
+        assert reaper.call_count == 1
+
+    # Reaper died before finishing its job: next run resumes it
+    runez.write(".pickley/.trash/.reaper", "0\n")
+    cli.run("--debug list")
+    assert "in background" in cli.logged  # Reaping happens once logging is setup
+    for _ in range(50):
+        if os.listdir(".pickley/.trash") == [".reaper"]:
+            break
+
+        time.sleep(0.1)
+
+    assert os.listdir(".pickley/.trash") == [".reaper"]
+
+    with patch("pickley.cli.delete_in_background") as reaper:
+        cli.run("uninstall --all")
+        assert cli.succeeded
+        assert not os.path.exists(".pickley")
+        assert len(os.listdir(".pickley.trash")) == 1
+        reaper.assert_called_once_with([os.path.abspath(".pickley.trash")])
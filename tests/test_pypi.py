@@ -1,7 +1,12 @@
-from mock import patch
+import os
+import time
 
-from pickley import CFG, PackageSpec
-from pickley.pypi import PepVersion, PypiInfo
+import requests
+import runez
+from mock import MagicMock, patch
+
+from pickley import CFG, PackageSpec, PickleyConfig, TrackedLatest
+from pickley.pypi import BREAKER_THRESHOLD, IndexStats, PepVersion, PypiInfo, request_get
 
 
 LEGACY_SAMPLE = """
@@ -53,7 +58,7 @@ def test_pypi(logged):
         assert str(i) == "some-proj 1.3.0"
         assert "not pypi canonical" in logged.pop()
 
-    with patch("requests.get", side_effect=IOError):
+    with patch("requests.get", side_effect=IOError), patch("time.sleep"):
         i = PypiInfo(None, PackageSpec(CFG, "foo"))
         assert "no data for" in i.problem
 
@@ -67,6 +72,21 @@ def test_pypi(logged):
         assert "Failed to parse pypi json" in logged.pop()
 
 
+def test_wheelhouse(temp_folder):
+    runez.touch("wheels/mgit-1.0.0-py2.py3-none-any.whl")
+    runez.touch("wheels/mgit-1.2.0-py2.py3-none-any.whl")
+    runez.touch("wheels/mgit-1.3.0rc1-py2.py3-none-any.whl")
+    runez.touch("wheels/mgit-1.1.0.tar.gz")
+    runez.touch("wheels/six-1.15.0-py2.py3-none-any.whl")
+    with patch("requests.get", side_effect=Exception("network should not be used")):
+        i = PypiInfo("wheels", PackageSpec(CFG, "mgit"))
+        assert not i.problem
+        assert i.latest == "1.2.0"
+
+        i = PypiInfo("wheels", PackageSpec(CFG, "foo"))
+        assert i.problem == "no versions published on wheels"
+
+
 def test_version():
     foo = PepVersion("foo")
     assert str(foo) == "foo"
@@ -91,3 +111,96 @@ def test_version():
     assert v2 > v1
     assert v3 > v2
     assert v4 > v3
+
+
+def test_request_retries():
+    ok = MagicMock(status_code=200, text="ok")
+    unavailable = MagicMock(status_code=503, text="unavailable")
+    with patch("time.sleep") as sleep:
+        with patch("requests.get", side_effect=[requests.ConnectionError, unavailable, ok]) as get:
+            assert request_get("https://example.com") == "ok"
+            assert get.call_count == 3
+            assert sleep.call_count == 2
+
+        with patch("requests.get", side_effect=[unavailable, unavailable, unavailable, ok]) as get:
+            assert request_get("https://example.com") is None
+            assert get.call_count == 3
+
+        with patch("requests.get", side_effect=requests.Timeout) as get:
+            assert request_get("https://example.com") is None
+            assert get.call_count == 1  # Timeouts are not retried
+
+        with patch("requests.get", return_value=MagicMock(status_code=404)) as get:
+            assert request_get("https://example.com") == "does not exist"
+
+
+def test_circuit_breaker(temp_folder, logged):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    pspec = PackageSpec(cfg, "mgit")
+    runez.save_json(TrackedLatest(index=pspec.index, source="latest", version="1.0").to_dict(), ".pickley/.cache/mgit.latest")
+    with patch("time.sleep"), patch("requests.get", side_effect=IOError) as get:
+        for _ in range(BREAKER_THRESHOLD - 1):
+            assert "check your connection" in PypiInfo(None, pspec).problem
+
+        i = PypiInfo(None, pspec)
+        assert "check your connection" in i.problem
+        assert i.breaker.is_open  # Threshold just reached
+        assert "failed 3 times in a row" in logged.pop()
+        get.reset_mock()
+
+        # Index is now considered down: network isn't used anymore, and last known good lookup is reused
+        i = PypiInfo(None, pspec)
+        assert "is down, not querying it until" in i.problem
+        desired = pspec.get_desired_version_info(force=True)
+        assert desired.version == "1.0"
+        assert not get.called
+
+    # Once cool-down expires, a successful lookup resets the breaker
+    with patch("time.time", return_value=time.time() + 3600):
+        with patch("pickley.pypi.request_get", return_value='{"info": {"version": "1.1"}}'):
+            i = PypiInfo(None, pspec)
+            assert i.latest == "1.1"
+            assert i.breaker.failures == 0
+            assert not os.path.exists(i.breaker.path)
+
+
+def test_index_mirrors(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    pspec = PackageSpec(cfg, "mgit")
+    assert cfg.index(pspec) is None
+    assert cfg.indexes(pspec) == [cfg.default_index]
+
+    cfg.set_base(".", flags=dict(index="https://a.example.com/pypi, https://b.example.com/pypi"))
+    assert cfg.indexes(pspec) == ["https://a.example.com/pypi", "https://b.example.com/pypi"]
+    cfg.set_base(".", flags=dict(index=["https://a.example.com/pypi", "https://b.example.com/pypi", "https://c.example.com/pypi"]))
+    assert cfg.index(pspec) == "https://a.example.com/pypi"  # No stats yet: configured order is respected
+
+    def mock_get(url, **_):
+        if url.startswith("https://a."):
+            raise IOError("unreachable")
+
+        time.sleep(0.01 if url.startswith("https://c.") else 0.05)
+        return MagicMock(status_code=200, text='{"info": {"version": "1.0"}}')
+
+    with patch("time.sleep"):  # Don't actually wait in between retries
+        with patch("requests.get", side_effect=mock_get) as get:
+            desired = pspec.get_desired_version_info(force=True)
+            assert get.call_count == 4  # 'a' tried 3 times, then failed over to 'b'
+            assert desired.index == "https://b.example.com/pypi"
+            assert desired.version == "1.0"
+
+    stats = IndexStats(cfg.cache.path)
+    assert stats.error_rate("https://a.example.com/pypi") == 1
+    assert stats.error_rate("https://b.example.com/pypi") == 0
+    assert cfg.index_stats().ranked(cfg.indexes(pspec)) == [
+        "https://c.example.com/pypi",  # Never tried yet, gets a chance
+        "https://b.example.com/pypi",
+        "https://a.example.com/pypi",  # Unhealthy, tried last
+    ]
+
+    stats.record("https://c.example.com/pypi", 0.2, failed=False)
+    stats.record("https://b.example.com/pypi", 0.1, failed=False)
+    assert IndexStats(cfg.cache.path).ranked(cfg.indexes(pspec))[0] == "https://b.example.com/pypi"
+    assert IndexStats(None).ranked(["b", "a"]) == ["b", "a"]
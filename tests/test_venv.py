@@ -1,11 +1,20 @@
+import base64
+import glob
+import hashlib
 import os
 import sys
+import tarfile
+import time
+import zipfile
 
+import pytest
 import runez
 from mock import patch
+from runez.render import PrettyTable
 
-from pickley import CFG, PackageSpec
-from pickley.package import clean_folder, PythonVenv
+from pickley import CFG, PackageSpec, PickleyConfig
+from pickley.package import build_wheels, cached_pip_wheel, clean_folder, local_wheel, PIP_MODES, PythonVenv, shared_pip, VenvPackager
+from pickley.package import reusable_venv, save_venv_fingerprint, VenvStripper, wheel_entry_points
 
 
 BOGUS_PIP_SHOW = """
@@ -55,3 +64,363 @@ def test_entry_points(temp_folder):
         pspec = PackageSpec(CFG, "bogus")
         venv = PythonVenv("", CFG.find_python(), None)
         assert venv.find_entry_points(pspec) is None
+
+
+def mock_wheel(path, **files):
+    runez.ensure_folder(os.path.dirname(path), logger=None)
+    with zipfile.ZipFile(path, "w") as zf:
+        for name, contents in files.items():
+            zf.writestr(name, contents)
+
+
+def test_wheel_entry_points(temp_folder, logged):
+    mock_wheel("w/mgit-1.0-py3-none-any.whl", **{"mgit-1.0.dist-info/entry_points.txt": "[console_scripts]\nmgit = mgit.cli:main\n"})
+    mock_wheel("w/Bogus_Lib-1.0-py3-none-any.whl", **{"bogus_lib/__init__.py": "", "bogus_lib-1.0.dist-info/RECORD": ""})
+    mock_wheel("w/tox-1.0-py3-none-any.whl", **{"tox-1.0.data/scripts/tox": "#!python"})
+    assert wheel_entry_points("w/mgit-1.0-py3-none-any.whl") == {"mgit": "mgit.cli:main"}
+    assert wheel_entry_points("w/Bogus_Lib-1.0-py3-none-any.whl") is None
+    assert wheel_entry_points("w/tox-1.0-py3-none-any.whl") == {"tox": "tox-1.0.data/scripts/tox"}
+
+    cfg = PickleyConfig()
+    cfg.set_base(".", flags=dict(wheelhouse="w"))
+    pspec = PackageSpec(cfg, "bogus-lib==1.0")
+    assert local_wheel(pspec, None, "no-such-folder", "w") == os.path.join("w", "Bogus_Lib-1.0-py3-none-any.whl")
+    pspec.version = "2.0"
+    assert local_wheel(pspec, "w") is None
+
+    # A library is rejected straight from its wheel, without any venv being created
+    pspec.version = "1.0"
+    with patch("pickley.package.pspec_venv", side_effect=Exception("should not be called")):
+        with pytest.raises(SystemExit):
+            VenvPackager.install(pspec)
+
+    assert "not a CLI" in logged.pop()
+
+
+def test_pip_wheel(temp_folder, logged):
+    python = CFG.find_python()
+    folder = "./pip-wheels/py%s.%s" % (python.major, python.minor)
+    runez.touch("%s/pip-9.0.1-py2.py3-none-any.whl" % folder)
+    runez.touch("%s/pip-20.1-py2.py3-none-any.whl" % folder)
+    with patch("runez.run") as run:
+        assert cached_pip_wheel(".", python, None) == "%s/pip-20.1-py2.py3-none-any.whl" % folder
+        assert not run.called
+
+        # Stale wheel: refresh is attempted, but not fatal
+        os.utime("%s/pip-20.1-py2.py3-none-any.whl" % folder, (0, 0))
+        assert cached_pip_wheel(".", python, None) == "%s/pip-20.1-py2.py3-none-any.whl" % folder
+        assert "download" in run.call_args[0]
+        assert run.call_args[1]["fatal"] is False
+
+        # Offline: stale wheel is used as-is, missing wheel is an error
+        run.reset_mock()
+        assert cached_pip_wheel(".", python, None, offline=True) == "%s/pip-20.1-py2.py3-none-any.whl" % folder
+        assert not run.called
+        with pytest.raises(SystemExit):
+            cached_pip_wheel("./empty", python, None, offline=True)
+        assert "No pip wheel cached in ./empty/pip-wheels" in logged.pop()
+        assert not run.called
+
+    with pytest.raises(SystemExit):
+        PythonVenv("", python, None, pip_mode="foo")
+    assert "Unknown pip mode 'foo'" in logged.pop()
+
+    # Shared pip gets unpacked from cached wheel
+    runez.delete(folder)
+    runez.write("pip-src/pip/__init__.py", "# pip")
+    runez.ensure_folder(folder)
+    runez.run(sys.executable, "-mzipfile", "-c", "%s/pip-20.2-py2.py3-none-any.whl" % folder, "pip-src/pip")
+    venv = PythonVenv("", python, None, pip_mode="shared", cache=".")
+    assert venv.pip_command == "./pip/pip-20.2-py2.py3-none-any/pip"
+    assert os.path.exists("pip/pip-20.2-py2.py3-none-any/pip/__init__.py")
+    assert shared_pip(".", python, None) == venv.pip_command  # Already unpacked
+
+
+def bundled_pip_wheel():
+    """Pip wheel shipped with ensurepip, if any (allows to test pip modes without network access)"""
+    try:
+        import ensurepip
+
+        wheels = glob.glob(os.path.join(os.path.dirname(ensurepip.__file__), "_bundled", "pip-*.whl"))
+        return wheels and wheels[0]
+
+    except ImportError:  # pragma: no cover, python2
+        return None
+
+
+def seed_pip_wheel_cache(cache, python):
+    """Put pip wheel shipped with ensurepip in pip wheels 'cache', as if it had just been downloaded"""
+    wheel = bundled_pip_wheel()
+    cached = os.path.join(cache, "pip-wheels", "py%s.%s" % (python.major, python.minor), os.path.basename(wheel))
+    runez.copy(wheel, cached, logger=None)
+    os.utime(cached, None)  # Fresh cached wheel, not refreshed
+
+
+def folder_size(folder):
+    """Total size in bytes of files in 'folder' (symlinks not followed)"""
+    total = 0
+    for dirpath, _, fnames in os.walk(folder):
+        total += sum(os.lstat(os.path.join(dirpath, fname)).st_size for fname in fnames)
+
+    return total
+
+
+@pytest.mark.skipif(not bundled_pip_wheel() or CFG.find_python().needs_virtualenv, reason="No bundled pip wheel available")
+def test_pip_modes(temp_folder):
+    python = CFG.find_python()
+    seed_pip_wheel_cache(".cache", python)
+    original_run = runez.run
+    downloads = []
+
+    def recording_run(*args, **kwargs):
+        if "download" in args:
+            downloads.append(args)
+
+        return original_run(*args, **kwargs)
+
+    with patch("runez.run", side_effect=recording_run):
+        for pip_mode in PIP_MODES:
+            venv = PythonVenv(os.path.abspath(pip_mode), python, None, pip_mode=pip_mode, cache=".cache")
+            assert venv._run_pip("--version", fatal=False).succeeded
+            has_own_pip = bool(glob.glob(os.path.join(venv.folder, "lib", "*", "site-packages", "pip")))
+            assert has_own_pip == (pip_mode != "shared")
+
+        # Shared pip is unpacked once, and reused by subsequent venvs
+        shared = PythonVenv(os.path.abspath("shared2"), python, None, pip_mode="shared", cache=".cache")
+        assert shared.pip_command == shared_pip(".cache", python, None)
+        assert shared._run_pip("--version", fatal=False).succeeded
+
+    assert not downloads  # Cached pip wheel was used throughout
+    assert len(os.listdir(".cache/pip")) == 1
+
+
+@pytest.mark.skipif(not os.environ.get("PICKLEY_BENCHMARK"), reason="Benchmark, opt-in via PICKLEY_BENCHMARK=1 (use -s to see report)")
+@pytest.mark.skipif(not bundled_pip_wheel() or CFG.find_python().needs_virtualenv, reason="No bundled pip wheel available")
+def test_pip_modes_benchmark(temp_folder):
+    python = CFG.find_python()
+    seed_pip_wheel_cache(".cache", python)  # Measure venv creation only, not initial download
+    shared_pip(".cache", python, None)  # Shared pip is unpacked once per pip version, not per venv
+    table = PrettyTable("Pip mode,Best time,Worst time,Venv size", border="github")
+    table.header.style = runez.bold
+    for pip_mode in PIP_MODES:
+        timings = []
+        for i in range(3):
+            started = time.time()
+            venv = PythonVenv(os.path.abspath("%s-%s" % (pip_mode, i)), python, None, pip_mode=pip_mode, cache=".cache")
+            timings.append(time.time() - started)
+            assert venv._run_pip("--version", fatal=False).succeeded
+
+        size = runez.represented_bytesize(folder_size(venv.folder))
+        table.add_row(pip_mode, runez.represented_duration(min(timings)), runez.represented_duration(max(timings)), size)
+
+    size = runez.represented_bytesize(folder_size(".cache/pip"))
+    table.add_row("(shared pip)", "", "", size)
+    print("\n%s" % table)
+
+
+def test_compile_bytecode(temp_folder):
+    venv = PythonVenv("", CFG.find_python(), None)
+    assert venv.compile_bytecode(0) is None  # No site-packages
+
+    runez.write("lib/python3.7/site-packages/foo/__init__.py", "x = 1")
+    venv.folder = "."
+    with patch("runez.run", return_value=runez.program.RunResult("", code=0)) as run:
+        venv.compile_bytecode(0)
+        args = runez.flattened(run.call_args[0])
+        assert "-mcompileall" in args
+        assert args[-1].endswith("lib/python3.7/site-packages")
+
+
+def test_strip(temp_folder):
+    sp = "lib/python3.7/site-packages"
+    runez.write("bin/mgit", "mgit")
+    runez.write("bin/pip", "pip")
+    runez.write("bin/pip3.7", "pip")
+    runez.write("bin/easy_install", "easy_install")
+    runez.write("include/python3.7/foo.h", "header")
+    runez.write("share/man/man1/mgit.1", "man")
+    runez.write(sp + "/pip/__init__.py", "pip")
+    runez.write(sp + "/pip-20.1.dist-info/METADATA", "Name: pip")
+    runez.write(sp + "/pipenv/__init__.py", "not pip")
+    runez.write(sp + "/setuptools/__init__.py", "setuptools")
+    runez.write(sp + "/mgit-1.0.dist-info/METADATA", "Name: mgit\nRequires-Dist: setuptools (>=40)\n")
+    runez.write(sp + "/mgit/__init__.py", "import os")
+    runez.write(sp + "/mgit/__pycache__/__init__.cpython-37.pyc", "compiled")
+    runez.write(sp + "/mgit/__pycache__/__init__.cpython-37.opt-1.pyc", "compiled")
+    runez.write(sp + "/mgit/cli.py", "no pyc")
+    runez.write(sp + "/mgit/tests/test_cli.py", "tests")
+    runez.write(sp + "/mgit/docs/index.rst", "docs")
+
+    stripper = VenvStripper(".", ["headers", "pip", "sources", "tests", "docs", "pycache"])
+    assert str(stripper) == ". [sources, pycache, pip, tests, docs, headers]"
+    saved = {rule: (files, size) for rule, files, size in stripper.strip()}
+    assert saved["sources"] == (1, 9)
+    assert saved["pip"] == (4, 18)
+    assert saved["tests"] == (1, 5)
+    assert saved["headers"] == (1, 6)
+
+    assert os.path.exists(sp + "/mgit/__init__.pyc")  # Moved to legacy location
+    assert not os.path.exists(sp + "/mgit/__init__.py")
+    assert not os.path.exists(sp + "/mgit/__pycache__")
+    assert os.path.exists(sp + "/mgit/cli.py")  # No .pyc available, source kept
+    assert not os.path.exists(sp + "/mgit/tests")
+    assert not os.path.exists(sp + "/mgit/docs")
+    assert not os.path.exists(sp + "/pip")
+    assert os.path.exists(sp + "/pipenv")
+    assert os.path.exists(sp + "/setuptools")  # Required by mgit
+    assert os.path.exists("bin/easy_install")
+    assert os.path.exists("bin/mgit")
+    assert not os.path.exists("bin/pip3.7")
+    assert not os.path.exists("include")
+    assert not os.path.exists("share/man")
+
+
+def test_venv_store(temp_folder, logged):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    assert cfg.venv_store() is None
+
+    cfg.set_base(".", flags=dict(venv_store="store"))
+    store = cfg.venv_store()
+    assert str(store) == "store"
+    pspec = PackageSpec(cfg, "mgit==1.0")
+    origin = os.path.abspath("host1/mgit-1.0")
+    target = os.path.abspath("host2/mgit-1.0")
+    assert not store.unpack(pspec, target)
+
+    runez.write(os.path.join(origin, "bin/mgit"), "#!%s/bin/python\nimport mgit\n" % origin)
+    runez.write(os.path.join(origin, "pyvenv.cfg"), "home = /usr/bin\ncommand = python -mvenv %s\n" % origin)
+    runez.write(os.path.join(origin, "lib/python3.7/site-packages/mgit/__init__.py"), "# mgit")
+    store.publish(pspec, PythonVenv(origin, pspec.python, None, create=False))
+    artifact = store.artifact_path(pspec)
+    assert os.path.exists(artifact)
+    assert os.path.basename(artifact).startswith("mgit-1.0-py%s-" % pspec.python.version)
+
+    assert store.unpack(pspec, target)
+    assert runez.readlines(os.path.join(target, "bin/mgit"))[0] == "#!%s/bin/python" % target
+    assert runez.readlines(os.path.join(target, "pyvenv.cfg"))[1] == "command = python -mvenv %s" % target
+    assert os.path.exists(os.path.join(target, "lib/python3.7/site-packages/mgit/__init__.py"))
+
+    # Corrupted tarball is not used
+    runez.write(artifact, "not a tarball")
+    assert not store.unpack(pspec, target)
+    assert "Could not use prebuilt venv" in logged.pop()
+    assert not os.listdir(target)
+
+    # Links must stay within venv (except for the one to the python interpreter), device files are not accepted
+    runez.delete(artifact)
+    runez.delete(os.path.join(origin, "bin/mgit"))
+    os.symlink(pspec.python.executable, os.path.join(origin, "bin/python"))
+    os.symlink("lib", os.path.join(origin, "lib64"))
+    store.publish(pspec, PythonVenv(origin, pspec.python, None, create=False))
+    assert store.unpack(pspec, target)
+    assert os.readlink(os.path.join(target, "bin/python")) == pspec.python.executable
+    assert os.readlink(os.path.join(target, "lib64")) == "lib"
+
+    for kind, linkname, expected in (
+        (tarfile.SYMTYPE, "/etc/passwd", "unsafe symlink 'foo'"),
+        (tarfile.SYMTYPE, "../../etc", "unsafe symlink 'foo'"),
+        (tarfile.SYMTYPE, "bin/../..", "unsafe symlink 'foo'"),
+        (tarfile.LNKTYPE, "/etc/passwd", "unsafe hard link 'foo'"),
+        (tarfile.LNKTYPE, "../etc/passwd", "unsafe hard link 'foo'"),
+        (tarfile.CHRTYPE, "", "unsupported type for 'foo'"),
+        (tarfile.FIFOTYPE, "", "unsupported type for 'foo'"),
+    ):
+        runez.delete(artifact)
+        with tarfile.open(artifact, "w:gz") as tar:
+            member = tarfile.TarInfo("foo")
+            member.type = kind
+            member.linkname = linkname
+            tar.addfile(member)
+
+        assert not store.unpack(pspec, target)
+        assert expected in logged.pop()
+        assert not os.listdir(target)
+
+    # Settings shaping the venv are part of the artifact key
+    cfg.set_base(".", flags=dict(venv_store="store", pip_mode="shared"))
+    assert store.artifact_path(PackageSpec(cfg, "mgit==1.0")) != artifact
+    cfg.set_base(".", flags=dict(venv_store="store", precompile=True))
+    assert store.artifact_path(PackageSpec(cfg, "mgit==1.0")) != artifact
+
+
+def test_build_wheels(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    pspec = PackageSpec(cfg, "mgit==1.0")
+    runez.touch("wheels/.tmp-mgit-0/other.whl")  # Staging folder of a concurrent run
+
+    def fake_pip_wheel(*args, **_):
+        folder = args[args.index("--wheel-dir") + 1]
+        assert folder == "wheels/.tmp-mgit-%s" % os.getpid()
+        runez.touch(os.path.join(folder, "mgit-1.0-py3-none-any.whl"), logger=None)
+        return runez.program.RunResult(code=0)
+
+    with patch("pickley.package.shared_pip", return_value="pip"):
+        with patch.object(pspec.python, "run", side_effect=fake_pip_wheel):
+            assert build_wheels(pspec, "wheels").succeeded
+
+    assert sorted(os.listdir("wheels")) == [".tmp-mgit-0", "mgit-1.0-py3-none-any.whl"]
+    assert os.listdir("wheels/.tmp-mgit-0") == ["other.whl"]
+
+
+def test_reusable_venv(temp_folder):
+    cfg = PickleyConfig()
+    cfg.set_base(".")
+    pspec = PackageSpec(cfg, "mgit==1.0")
+    folder = pspec.install_path
+    site_packages = os.path.join(folder, "lib/python3.7/site-packages")
+    runez.write(os.path.join(site_packages, "mgit/__init__.py"), "# mgit")
+    digest = "sha256=%s" % base64.urlsafe_b64encode(hashlib.sha256(b"# mgit").digest()).rstrip(b"=").decode("ascii")
+    runez.write(os.path.join(site_packages, "mgit-1.0.dist-info/RECORD"), "mgit/__init__.py,%s,6\nmgit-1.0.dist-info/RECORD,,\n" % digest)
+    runez.write(os.path.join(folder, "bin/python"), "#!/bin/sh\n")
+    runez.make_executable(os.path.join(folder, "bin/python"))
+    assert not reusable_venv(folder, pspec)  # No fingerprint yet
+
+    save_venv_fingerprint(folder, pspec)
+    assert reusable_venv(folder, pspec)
+
+    with patch("pickley.PickleyConfig.indexes", return_value=["https://example.com/pypi"]):
+        assert not reusable_venv(folder, pspec)  # Different index
+
+    cfg.set_base(".", flags=dict(pip_mode="shared"))
+    assert not reusable_venv(folder, PackageSpec(cfg, "mgit==1.0"))  # Different pip mode
+    cfg.set_base(".", flags=dict(precompile=True))
+    assert not reusable_venv(folder, PackageSpec(cfg, "mgit==1.0"))  # Different precompile setting
+    cfg.set_base(".")
+    assert reusable_venv(folder, pspec)
+
+    runez.write(os.path.join(site_packages, "mgit/__init__.py"), "# modified")
+    assert not reusable_venv(folder, pspec)  # Modified file
+
+    runez.delete(os.path.join(site_packages, "mgit/__init__.py"))
+    assert not reusable_venv(folder, pspec)  # Missing file
+
+    runez.write(os.path.join(site_packages, "mgit/__init__.py"), "# mgit")
+    runez.write(os.path.join(site_packages, "foo-1.0.dist-info/RECORD"), "")
+    assert not reusable_venv(folder, pspec)  # Other packages installed since
+
+    with patch("pickley.package.reusable_venv", return_value=True):
+        with patch("pickley.package.PythonVenv.find_entry_points", return_value={"mgit": "mgit.cli:main"}):
+            with patch("pickley.delivery.DeliveryMethod.install", return_value="delivered") as delivered:
+                with patch("pickley.package.PythonVenv.run_python", side_effect=Exception("should not be called")):
+                    assert VenvPackager.install(pspec) == "delivered"
+                    assert delivered.call_args[0][1].folder == folder
+
+
+def test_watchdog(temp_folder, logged):
+    runez.touch("venv/bin/python")
+    venv = PythonVenv("venv", None, None, create=False, timeout=0.5)
+    assert venv._run_watched("pip show", "/bin/sh", "-c", "echo hello").output == "hello"
+    assert "Running: /bin/sh" in logged.pop()
+
+    with pytest.raises(SystemExit):
+        venv._run_watched("pip show", "/bin/sh", "-c", "exit 3")
+    assert "pip show failed: exit code 3" in logged.pop()
+
+    started = time.time()
+    with pytest.raises(SystemExit):
+        venv._run_watched("pip install", "/bin/sh", "-c", "sleep 30")
+    assert time.time() - started < 5
+    assert "pip install hung, killed it after install timeout of 500 ms, cleaned up venv" in logged.pop()
+    assert not os.path.exists("venv")